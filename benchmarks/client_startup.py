@@ -0,0 +1,66 @@
+"""Benchmarks constructing the Google API clients a GoogleService needs.
+
+Compares building the docs, sheets and drive clients from the pinned
+discovery documents with the library's own static documents and with
+fetching them from the discovery service, then measures a service
+authenticating against the warm client registry. No API calls are made,
+the credentials are anonymous.
+
+Run from the repository root: python benchmarks/client_startup.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.discovery import build
+from clients import DISCOVERY_APIS, ThreadLocalHttp, build_client
+from credentials import credential_manager
+
+
+class ValidCredentials(AnonymousCredentials):
+	@property
+	def valid(self):
+		return True
+
+
+def timed(label, function, repeat=5):
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		try:
+			function()
+		except Exception as e:
+			print(f"{label:>40}: failed, {e.__class__.__name__}: {e}")
+			return
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	print(f"{label:>40}: {best:.4f}s")
+
+
+def build_all(builder):
+	http = ThreadLocalHttp(ValidCredentials())
+	return lambda: [builder(name, version, http) for name, version in DISCOVERY_APIS]
+
+
+def main():
+	timed('pinned documents (build_client)', build_all(build_client))
+	timed('library static documents (build)', build_all(
+			lambda name, version, http: build(name, version, http=http, static_discovery=True)))
+	timed('discovery service (build)', build_all(
+			lambda name, version, http: build(name, version, http=http, static_discovery=False, cache_discovery=False)),
+			repeat=1)
+
+	# Imported late so the cold registry is only filled below
+	from gsuite import GoogleService
+
+	# Seeded, so authenticate neither reads the user's token file nor logs in
+	credential_manager.credentials = ValidCredentials()
+	timed('first service, cold registry', lambda: GoogleService().authenticate(), repeat=1)
+	timed('100 services, warm registry', lambda: [GoogleService().authenticate() for _ in range(100)])
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,103 @@
+"""Benchmarks reading the text of a large Google Docs body.
+
+Compares gsuite.read_strucutural_elements with the recursive `text +=`
+implementation it replaced, on synthetic bodies of several megabytes
+mixing paragraphs, tables and a table of contents. The recursive version
+copies the text of every table once per table it is nested in, which the
+nested bodies show. Also checks that a deeply nested table no longer
+exhausts the recursion limit.
+
+Run from the repository root: python benchmarks/document_text.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gsuite import read_strucutural_elements, read_paragraph_element
+
+
+def recursive_read(elements):
+	text = ''
+	for value in elements:
+		if 'paragraph' in value:
+			for elem in value.get('paragraph').get('elements'):
+				text += read_paragraph_element(elem)
+		elif 'table' in value:
+			for row in value.get('table').get('tableRows'):
+				for cell in row.get('tableCells'):
+					text += recursive_read(cell.get('content'))
+		elif 'tableOfContents' in value:
+			text += recursive_read(value.get('tableOfContents').get('content'))
+	return text
+
+
+def paragraph(text):
+	return {'paragraph': {'elements': [{'textRun': {'content': text}}, {'inlineObjectElement': {}}]}}
+
+
+def table(rows, columns, content):
+	return {'table': {'tableRows': [
+			{'tableCells': [{'content': content()} for _ in range(columns)]} for _ in range(rows)]}}
+
+
+def synthetic_body(size):
+	"""Docs body content with about `size` characters of text."""
+	line = 'for (int32 Index = 0; Index < Actors.Num(); ++Index) { Actors[Index]->Tick(DeltaSeconds); }\n'
+	content = [{'tableOfContents': {'content': [paragraph(f'Section {i}\n') for i in range(20)]}}]
+	written = 0
+
+	while written < size:
+		content.extend(paragraph(line) for _ in range(50))
+		content.append(table(4, 3, lambda: [paragraph(line), table(2, 2, lambda: [paragraph(line)])]))
+		written += len(line) * (50 + 4 * 3 * (1 + 4))
+	return content
+
+
+def nested_body(depth, content=None, heading=False):
+	"""`content` wrapped in `depth` tables, each one after a heading paragraph when `heading` is set."""
+	content = content or [paragraph('innermost\n')]
+	for level in range(depth):
+		content = ([paragraph(f'Level {level}\n')] if heading else []) + [table(1, 1, lambda content=content: content)]
+	return content
+
+
+def timed(function, *args, repeat=3):
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		result = function(*args)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return result, best
+
+
+def main():
+	for size in (1_000_000, 4_000_000, 16_000_000):
+		body = synthetic_body(size)
+		text, streaming = timed(read_strucutural_elements, body)
+		expected, recursive = timed(recursive_read, body)
+		assert text == expected
+		print(f"{len(text) / 1e6:5.1f} MB text: read_strucutural_elements {streaming:.3f}s, recursive += {recursive:.3f}s")
+
+	for depth in (10, 100, 400):
+		body = nested_body(depth, synthetic_body(4_000_000), heading=True)
+		text, streaming = timed(read_strucutural_elements, body)
+		expected, recursive = timed(recursive_read, body)
+		assert text == expected
+		print(f"{len(text) / 1e6:5.1f} MB text in {depth} nested tables: "
+				f"read_strucutural_elements {streaming:.3f}s, recursive += {recursive:.3f}s")
+
+	depth = sys.getrecursionlimit() * 2
+	text, elapsed = timed(read_strucutural_elements, nested_body(depth), repeat=1)
+	assert text == 'innermost\n'
+	print(f"{depth} nested tables: read_strucutural_elements {elapsed:.3f}s")
+	try:
+		recursive_read(nested_body(depth))
+	except RecursionError:
+		print(f"{depth} nested tables: recursive += hits the recursion limit")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,63 @@
+"""Benchmarks typo tolerant lookups in search.FuzzyIndex.
+
+Builds the index over 50,000 synthetic titles with a vocabulary of about
+30,000 words and looks up words of every length with one typo. Reports
+the slowest lookup per token length and checks the matches against
+bounded_distance over the whole vocabulary.
+
+Run from the repository root: python benchmarks/fuzzy_search.py
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import FuzzyIndex, TextIndex, bounded_distance
+
+LETTERS = 'etaoinshrdlcumwfgypbvkjxqz'
+# English letter frequencies, so bigram posting lists are as uneven as in real titles
+FREQUENCIES = [12, 9, 8, 7.5, 7, 6.7, 6.3, 6, 5.9, 4.3, 4, 2.8, 2.8, 2.4, 2.4, 2.2, 2, 2, 1.9, 1.5, 1, .8, .15, .15, .1, .07]
+
+
+def synthetic_titles(rng, words, rows):
+	vocabulary = set()
+	while len(vocabulary) < words:
+		length = rng.choice([2, 3, 3, 4, 4, 5, 5, 5, 6, 6, 6, 7, 7, 8, 8, 9, 10, 11, 12])
+		vocabulary.add(''.join(rng.choices(LETTERS, FREQUENCIES, k=length)))
+	vocabulary = sorted(vocabulary)
+	return [' '.join(rng.choice(vocabulary) for _ in range(rng.randint(2, 5))) for _ in range(rows)]
+
+
+def typo(rng, word):
+	i = rng.randrange(len(word))
+	return word[:i] + rng.choice(LETTERS) + word[i + 1:]
+
+
+def main():
+	rng = random.Random(5)
+	titles = synthetic_titles(rng, 30000, 50000)
+
+	start = time.perf_counter()
+	fuzzy = FuzzyIndex(TextIndex(titles).tokens)
+	print(f"{len(fuzzy.tokens)} words indexed in {time.perf_counter() - start:.2f}s")
+
+	for length in range(2, 13):
+		words = [word for word in fuzzy.tokens if len(word) == length][:50]
+		slowest = 0
+		incomplete = 0
+		for word in words:
+			token = typo(rng, word)
+			start = time.monotonic()
+			found = fuzzy.similar(token, start + 10)
+			slowest = max(slowest, time.monotonic() - start)
+
+			limit = fuzzy.max_distance(token)
+			expected = {other for other in fuzzy.tokens if bounded_distance(token, other, limit) is not None}
+			incomplete += set(found) != expected
+		print(f"{length:2} letters: slowest lookup {slowest * 1000:6.2f}ms, {incomplete} of {len(words)} incomplete")
+
+
+if __name__ == '__main__':
+	main()
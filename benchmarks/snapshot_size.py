@@ -0,0 +1,60 @@
+"""Benchmarks saving and loading the notes snapshot.
+
+Builds the snapshot of 100,000 synthetic rows the way NotesService.get_cache
+does and reports the pickled size, save and load times, and the time to
+append one row with NotesService.apply_append.
+
+Run from the repository root: python benchmarks/snapshot_size.py
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshot
+from gsuite import NotesService
+from snapshot import NoteRow, save_snapshot, load_snapshot
+from fuzzy_search import synthetic_titles
+
+ROWS = 100000
+
+
+def main():
+	rng = random.Random(7)
+	titles = synthetic_titles(rng, 30000, ROWS)
+	records = {}
+	for i, title in enumerate(titles):
+		link = f'https://docs.google.com/document/d/{rng.getrandbits(128):032x}/edit'
+		records.setdefault(f'Sheet {i % 20}', []).append(NoteRow(f'Sheet {i % 20}', f'Category {i % 300}', title, link))
+	row_counts = {sheet: len(rows) + 1 for sheet, rows in records.items()}
+
+	start = time.perf_counter()
+	built = NotesService._build_snapshot(records, '1', row_counts)
+	print(f"{ROWS} rows indexed in {time.perf_counter() - start:.2f}s")
+
+	with tempfile.TemporaryDirectory() as directory, mock.patch.object(snapshot, 'SNAPSHOTS_DIR', Path(directory)):
+		start = time.perf_counter()
+		save_snapshot('notes', 'benchmark', built)
+		print(f"saved in {time.perf_counter() - start:.2f}s, "
+				f"{os.path.getsize(snapshot.snapshot_path('notes', 'benchmark')) / 1e6:.1f}MB")
+
+		start = time.perf_counter()
+		loaded = load_snapshot('notes', 'benchmark')
+		print(f"loaded in {time.perf_counter() - start:.2f}s")
+
+		notes = NotesService('benchmark')
+		NotesService.snapshot = loaded
+		sheet = 'Sheet 0'
+		start = time.perf_counter()
+		notes.apply_append(sheet, ['Category 0', 'appended row'],
+				{'updatedRows': 1, 'updatedRange': f"'{sheet}'!A{row_counts[sheet] + 1}:D{row_counts[sheet] + 1}"})
+		print(f"row appended in {time.perf_counter() - start:.3f}s")
+
+
+if __name__ == '__main__':
+	main()
@@ -1,4 +1,7 @@
+from multiprocessing import freeze_support
 from main import main
 
 if __name__ == '__main__':
+    # Required by the search process pool in frozen Windows builds
+    freeze_support()
     main()
@@ -0,0 +1,159 @@
+import sys
+import json
+import hashlib
+import argparse
+import threading
+import uritemplate
+from googleapiclient.discovery import build, build_from_document, V2_DISCOVERY_URI
+from googleapiclient.http import build_http
+from google_auth_httplib2 import AuthorizedHttp
+from config import DISCOVERY_DIR
+from credentials import credential_manager
+
+# APIs whose discovery documents ship in DISCOVERY_DIR
+DISCOVERY_APIS = (('docs', 'v1'), ('sheets', 'v4'), ('drive', 'v3'))
+# sha256sum style list of the pinned documents
+DISCOVERY_MANIFEST = DISCOVERY_DIR / 'SHA256SUMS'
+
+
+def discovery_path(name, version):
+	return DISCOVERY_DIR / f'{name}.{version}.json'
+
+
+def read_manifest():
+	try:
+		lines = DISCOVERY_MANIFEST.read_text().splitlines()
+	except OSError:
+		return {}
+	return {filename: digest for digest, filename in (line.split() for line in lines if line.strip())}
+
+
+def load_discovery_document(name, version):
+	"""Returns the pinned discovery document of an API.
+
+		Returns None when it is missing or its checksum does not match the manifest.
+	"""
+	path = discovery_path(name, version)
+	try:
+		content = path.read_bytes()
+	except OSError as e:
+		print(f"No pinned discovery document for {name} {version}: {e}")
+		return None
+
+	if hashlib.sha256(content).hexdigest() != read_manifest().get(path.name):
+		print(f"Ignoring discovery document {path.name}, it does not match {DISCOVERY_MANIFEST.name}")
+		return None
+	return content.decode('utf-8')
+
+
+def build_client(name, version, http):
+	"""Builds an API client from its pinned discovery document, without network access."""
+	document = load_discovery_document(name, version)
+	if document is None:
+		# The library ships discovery documents of its own
+		return build(name, version, http=http, static_discovery=True)
+	return build_from_document(document, http=http)
+
+
+def refresh_discovery_documents():
+	"""Downloads the current discovery documents of DISCOVERY_APIS and pins them."""
+	http = build_http()
+	lines = []
+
+	for name, version in DISCOVERY_APIS:
+		url = uritemplate.expand(V2_DISCOVERY_URI, {'api': name, 'apiVersion': version})
+		response, content = http.request(url)
+		if response.status != 200:
+			raise ValueError(f"Could not download the discovery document of {name} {version}: HTTP {response.status}")
+		json.loads(content)
+
+		path = discovery_path(name, version)
+		path.write_bytes(content)
+		lines.append(f'{hashlib.sha256(content).hexdigest()}  {path.name}')
+		print(f"Pinned {path.name} revision {json.loads(content).get('revision')}")
+
+	DISCOVERY_MANIFEST.write_text('\n'.join(sorted(lines, key=lambda line: line.split()[1])) + '\n')
+
+
+class ThreadLocalHttp:
+	"""httplib2.Http stand-in that sends every request through an AuthorizedHttp of the calling thread.
+
+	httplib2.Http is not thread safe, so discovery resources built on this
+	object can be shared by all threads.
+	"""
+
+	def __init__(self, credentials):
+		self.credentials = credentials
+		self._local = threading.local()
+
+	@property
+	def http(self):
+		http = getattr(self._local, 'http', None)
+		if http is None:
+			http = self._local.http = AuthorizedHttp(self.credentials, http=build_http())
+		return http
+
+	def request(self, *args, **kwargs):
+		# Expired tokens are refreshed once by the credential manager instead of by every transport
+		if not self.credentials.valid:
+			credential_manager.refresh(self.credentials)
+		return self.http.request(*args, **kwargs)
+
+	def close(self):
+		http = getattr(self._local, 'http', None)
+		if http is not None:
+			http.close()
+			self._local.http = None
+
+
+class ClientRegistry:
+	"""Process wide Google API clients.
+
+	Holds the credentials shared by every GoogleService and the discovery
+	resources built on them, each resource is built once per set of
+	credentials.
+	"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.credentials = None
+		self._http = None
+		self._resources = {}
+
+	def bind(self, credentials):
+		"""Shares `credentials`, resources built on earlier credentials are dropped."""
+		with self._lock:
+			if credentials is not self.credentials:
+				self.credentials = credentials
+				self._http = ThreadLocalHttp(credentials)
+				self._resources = {}
+
+	def resource(self, name, version, collection=None):
+		"""Returns the shared resource of an API, or of one of its collections."""
+		with self._lock:
+			if self._http is None:
+				raise PermissionError('No credentials bound to the Google API clients')
+
+			resource = self._resources.get((name, version, collection))
+			if resource is None:
+				service = self._resources.get((name, version, None))
+				if service is None:
+					service = self._resources[name, version, None] = build_client(name, version, self._http)
+				resource = getattr(service, collection)() if collection else service
+				self._resources[name, version, collection] = resource
+			return resource
+
+
+clients = ClientRegistry()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Google API clients')
+	parser.add_argument('--refresh-discovery', action='store_true',
+			help=f'download the current discovery documents to {DISCOVERY_DIR}')
+	args = parser.parse_args()
+
+	if not args.refresh_discovery:
+		parser.print_help()
+		sys.exit(1)
+	refresh_discovery_documents()
@@ -7,8 +7,49 @@ SETTINGS_DIR= Path.home() / ".sheetsearch"
 SETTINGS_DIR.mkdir(exist_ok=True)
 SETTINGS_FILE = SETTINGS_DIR / 'settingsv2.json'
 TOKEN_FILE = SETTINGS_DIR / 'tokenV3.json'
+# Seconds before the access token expires at which it is refreshed in the background
+TOKEN_REFRESH_MARGIN = 300
 TOPICS_FILE = SETTINGS_DIR / 'topics.json'
 ASSETS_CACHE = SETTINGS_DIR / 'assets'
 ICONS_CACHE = SETTINGS_DIR / 'icons'
 ASSETS_CACHE.mkdir(exist_ok=True)
 ICONS_CACHE.mkdir(exist_ok=True)
+
+# Queries starting with FUZZY_PREFIX are matched with typo tolerance
+FUZZY_PREFIX = '~'
+FUZZY_SEARCH_BUDGET = 0.2
+
+# Milliseconds of typing inactivity before a live search starts
+LIVE_SEARCH_DELAY = 250
+
+# Pinned Google API discovery documents, refreshed with: python clients.py --refresh-discovery
+DISCOVERY_DIR = Path('assets') / 'discovery'
+
+SNAPSHOTS_DIR = SETTINGS_DIR / 'snapshots'
+SNAPSHOTS_DIR.mkdir(exist_ok=True)
+# Text of the Google Docs linked from the notes sheets, see docstore.DocumentStore
+DOCUMENTS_FILE = SETTINGS_DIR / 'documents.pickle'
+
+# Seconds between background cache revalidations, doubled up to the maximum while offline
+CACHE_REFRESH_INTERVAL = 300
+CACHE_REFRESH_MAX_INTERVAL = 3600
+
+# Number of distinct searches whose results are kept in memory
+SEARCH_RESULT_CACHE_SIZE = 128
+
+# Regex searches over at least this many rows run sharded over a process pool,
+# None disables it. PARALLEL_SEARCH_WORKERS defaults to the number of CPUs.
+PARALLEL_SEARCH_THRESHOLD = 50000
+PARALLEL_SEARCH_WORKERS = None
+
+# Seconds a regex search may take before it falls back to literal matching
+REGEX_SEARCH_BUDGET = 2.0
+
+# Number of notes search results ordered by relevance, the rest keep the sheet order
+RANK_TOP_K = 100
+
+# Number of code documents of the shown search results whose text is fetched ahead of a copy
+CODE_PREFETCH_LIMIT = 50
+
+# Number of rows of every sheet read per request when loading a cache
+SHEET_WINDOW_ROWS = 5000
@@ -0,0 +1,121 @@
+import os
+import datetime
+import tempfile
+import threading
+import google.auth.exceptions
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from config import GOOGLE_APP_CONFIG, TOKEN_FILE, TOKEN_REFRESH_MARGIN
+
+
+class CredentialManager:
+	"""Loads, refreshes and saves the user's OAuth credentials for every thread.
+
+	Reading the token file, refreshing and writing it back happen under one
+	lock. Threads that need credentials at the same time wait for a single
+	refresh and share its result. A timer refreshes the token
+	TOKEN_REFRESH_MARGIN seconds before it expires, so requests do not wait
+	for refreshes.
+	"""
+	# Seconds before a failed background refresh is retried
+	RETRY_DELAY = 60
+
+	def __init__(self, path):
+		self.path = path
+		self.credentials = None
+		self._lock = threading.RLock()
+		self._timer = None
+
+	def get(self, scopes, dry_run=False):
+		"""Returns valid credentials, logging the user in when there are none."""
+		credentials = self.credentials
+		if credentials is not None and credentials.valid:
+			return credentials
+
+		with self._lock:
+			# Another thread may have refreshed them while this one waited
+			credentials = self.credentials
+			if credentials is not None and credentials.valid:
+				return credentials
+
+			if os.path.exists(self.path):
+				credentials = Credentials.from_authorized_user_file(self.path, scopes)
+
+			# If there are no (valid) credentials available, let the user log in.
+			if not credentials or not credentials.valid:
+				if credentials and credentials.expired and credentials.refresh_token:
+					credentials.refresh(Request())
+
+					if not credentials.valid:
+						raise PermissionError(f'Credentials are invalid after refresh')
+				else:
+					if dry_run:
+						raise PermissionError(f'No valid credentials on the system.')
+					flow = InstalledAppFlow.from_client_config(GOOGLE_APP_CONFIG, scopes)
+					credentials = flow.run_local_server(port=4338)
+
+				self._save(credentials)
+
+			self.credentials = credentials
+			self._schedule()
+			return credentials
+
+	def refresh(self, credentials):
+		"""Refreshes expired `credentials`, unless another thread already did."""
+		with self._lock:
+			if credentials.valid:
+				return
+
+			credentials.refresh(Request())
+			self._save(credentials)
+			if credentials is self.credentials:
+				self._schedule()
+
+	def _schedule(self):
+		if self._timer is not None:
+			self._timer.cancel()
+			self._timer = None
+
+		credentials = self.credentials
+		if credentials.expiry is None or not credentials.refresh_token:
+			return
+
+		remaining = (credentials.expiry - datetime.datetime.utcnow()).total_seconds()
+		self._start_timer(max(remaining - TOKEN_REFRESH_MARGIN, 0))
+
+	def _start_timer(self, delay):
+		self._timer = threading.Timer(delay, self._refresh_ahead)
+		self._timer.daemon = True
+		self._timer.start()
+
+	def _refresh_ahead(self):
+		with self._lock:
+			try:
+				self.credentials.refresh(Request())
+			except google.auth.exceptions.RefreshError as e:
+				# Revoked or expired refresh token, the next request logs in again
+				print(f"Token refresh failed: {e}")
+				return
+			except google.auth.exceptions.TransportError as e:
+				print(f"Token refresh failed, retrying in {self.RETRY_DELAY}s: {e}")
+				self._start_timer(self.RETRY_DELAY)
+				return
+
+			self._save(self.credentials)
+			self._schedule()
+
+	def _save(self, credentials):
+		# Save the credentials for the next run, atomically so readers never see a partial file
+		fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+		try:
+			with os.fdopen(fd, 'w') as token:
+				token.write(credentials.to_json())
+			os.replace(tmp, self.path)
+		except OSError as e:
+			print(f"Could not save credentials: {e}")
+			if os.path.exists(tmp):
+				os.remove(tmp)
+
+
+credential_manager = CredentialManager(TOKEN_FILE)
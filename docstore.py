@@ -0,0 +1,149 @@
+import os
+import re
+import pickle
+import tempfile
+import threading
+from collections import defaultdict
+from search import TOKEN_RE, normalize
+
+# Bump when the layout of the pickled documents changes
+DOCUMENTS_FORMAT = 1
+
+DOCUMENT_ID_RE = re.compile('document/d/([^/]+)')
+
+
+def document_id(url):
+	"""Returns the id of the Google Doc `url` points to, or None."""
+	match = DOCUMENT_ID_RE.search(url or '')
+	return match.group(1) if match else None
+
+
+class DocumentStore:
+	"""Text of the Google Docs linked from the notes sheets, keyed by document id.
+
+	Every document is kept with the Drive version it was fetched at and
+	indexed by the words of its normalized text. The indexer updates the
+	store while searches read it, all access goes through `lock`.
+	`generation` changes with every update.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.RLock()
+		self.load_lock = threading.Lock()
+		self.loaded = False
+		self.generation = 0
+		self.documents = {}
+		self.keys = {}
+		self.postings = defaultdict(set)
+
+	def version(self, doc_id):
+		with self.lock:
+			document = self.documents.get(doc_id)
+			return document[0] if document else None
+
+	def text(self, doc_id):
+		with self.lock:
+			document = self.documents.get(doc_id)
+			return document[1] if document else None
+
+	def ids(self):
+		with self.lock:
+			return set(self.documents)
+
+	def put(self, doc_id, version, text):
+		with self.lock:
+			self.discard(doc_id)
+			key = normalize(text)
+			self.documents[doc_id] = version, text
+			self.keys[doc_id] = key
+			for token in set(TOKEN_RE.findall(key)):
+				self.postings[token].add(doc_id)
+			self.generation += 1
+
+	def discard(self, doc_id):
+		with self.lock:
+			key = self.keys.pop(doc_id, None)
+			if key is None:
+				return
+
+			del self.documents[doc_id]
+			for token in set(TOKEN_RE.findall(key)):
+				posting = self.postings[token]
+				posting.discard(doc_id)
+				if not posting:
+					del self.postings[token]
+			self.generation += 1
+
+	def search(self, literal):
+		"""Returns the ids of the documents containing `literal`, a normalized string."""
+		with self.lock:
+			tokens = TOKEN_RE.findall(literal)
+			if not tokens:
+				ids = self.keys
+			else:
+				# The first and last word may be cut off in the documents,
+				# the words between are complete
+				ids = None
+				for token in set(tokens):
+					if token in (tokens[0], tokens[-1]):
+						found = set()
+						for word, posting in self.postings.items():
+							if token in word:
+								found |= posting
+					else:
+						found = self.postings.get(token, set())
+					ids = found if ids is None else ids & found
+					if not ids:
+						return set()
+
+			return {doc_id for doc_id in ids if literal in self.keys[doc_id]}
+
+	def load(self):
+		"""Reads the documents saved by `save`, once.
+
+		The documents are indexed without holding `lock` and swapped in
+		when done, readers find the store empty until then.
+		"""
+		with self.load_lock:
+			if not self.loaded:
+				self._read()
+				self.loaded = True
+
+	def _read(self):
+		try:
+			with open(self.path, 'rb') as f:
+				version, documents = pickle.load(f)
+		except FileNotFoundError:
+			return
+		except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError) as e:
+			print(f"Ignoring unreadable document store: {e}")
+			return
+
+		if version != DOCUMENTS_FORMAT:
+			return
+		store = DocumentStore(self.path)
+		for doc_id, (doc_version, text) in documents.items():
+			store.put(doc_id, doc_version, text)
+
+		with self.lock:
+			# Documents put meanwhile are newer than the saved ones
+			for doc_id, (doc_version, text) in self.documents.items():
+				store.put(doc_id, doc_version, text)
+			self.documents, self.keys, self.postings = store.documents, store.keys, store.postings
+			self.generation += 1
+
+	def save(self):
+		"""Atomically writes the documents to disk."""
+		with self.lock:
+			documents = dict(self.documents)
+
+		fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix='.tmp')
+		try:
+			with os.fdopen(fd, 'wb') as f:
+				pickle.dump((DOCUMENTS_FORMAT, documents), f, protocol=pickle.HIGHEST_PROTOCOL)
+			os.replace(tmp, self.path)
+		except OSError as e:
+			print(f"Could not save document store: {e}")
+			if os.path.exists(tmp):
+				os.remove(tmp)
@@ -1,20 +1,27 @@
 import os.path
 import re
 import functools
-from collections import deque
+from collections import deque, defaultdict, Counter
 from pathlib import Path
 import io
 import os
 import shutil
+import threading
+import time
 import backoff
 import pathlib
 import googleapiclient
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.http import MediaIoBaseDownload
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from config import GOOGLE_APP_CONFIG, TOKEN_FILE, ASSETS_CACHE, ICONS_CACHE, SETTINGS_DIR
+from config import TOKEN_FILE, ASSETS_CACHE, ICONS_CACHE, SETTINGS_DIR, DOCUMENTS_FILE, FUZZY_PREFIX, FUZZY_SEARCH_BUDGET, SEARCH_RESULT_CACHE_SIZE, REGEX_SEARCH_BUDGET, RANK_TOP_K, SHEET_WINDOW_ROWS
+from parallel import regex_search
+from clients import clients
+from credentials import credential_manager
+from docstore import DocumentStore, document_id
+from snapshot import Snapshot, NoteRow, AssetRow, save_snapshot, load_snapshot
+from search import TextIndex, FacetIndex, BM25Index, FuzzyIndex, ResultCache, SearchTimeout, SearchInterrupted, normalize, plan_query, parse_facets, rank_fields, result_key, within_budget
+
+# Statuses of rate limited or failed requests that are worth retrying
+RETRIED_STATUSES = (429, 500, 502, 503, 504)
 
 def check_creds(func):
 	@functools.wraps(func)
@@ -31,37 +38,24 @@ class GoogleService:
         'https://www.googleapis.com/auth/documents',
         'https://www.googleapis.com/auth/drive'
         ]
+	# Sheet titles of the spreadsheet as last read, set per service class
+	sheet_names = None
 
 	def __init__(self):
 		self.creds = None
+		# Set by searches that could not run the query as typed, see search.QueryPlan
+		self.notice = None
 
 
 	def authenticate(self, dry_run=False):
-		if os.path.exists(TOKEN_FILE):
-			self.creds = Credentials.from_authorized_user_file(TOKEN_FILE, self.SCOPES)
-
-		# If there are no (valid) credentials available, let the user log in.
-		if not self.creds or not self.creds.valid:
-			if self.creds and self.creds.expired and self.creds.refresh_token:
-				self.creds.refresh(Request())
-
-				if not self.creds.valid:
-					raise PermissionError(f'Credentials are invalid after refresh')
-			else:
-				if dry_run:
-					raise PermissionError(f'No valid credentials on the system.')
-				flow = InstalledAppFlow.from_client_config(
-				GOOGLE_APP_CONFIG, self.SCOPES)
-				self.creds = flow.run_local_server(port=4338)
-
-			# Save the credentials for the next run
-			with open(TOKEN_FILE, 'w') as token:
-				token.write(self.creds.to_json())
+		# Credentials are loaded and refreshed once for all services and threads
+		self.creds = credential_manager.get(self.SCOPES, dry_run)
 
 		if self.creds.valid:
-			self.docs = build('docs', 'v1', credentials=self.creds).documents()
-			self.sheets = build('sheets', 'v4', credentials=self.creds).spreadsheets()
-			self.drive = build('drive', 'v3', credentials=self.creds)
+			clients.bind(self.creds)
+			self.docs = clients.resource('docs', 'v1', 'documents')
+			self.sheets = clients.resource('sheets', 'v4', 'spreadsheets')
+			self.drive = clients.resource('drive', 'v3')
 		else:
 			raise PermissionError(f'Google Authorized user file does not exist: {TOKEN_FILE}')
 
@@ -75,10 +69,45 @@ class GoogleService:
 							range=sheet + '!' + _range,
 							body=body)
 		result = request.execute()
-		# Update cache
-		self.get_cache()
+		# Update cache, refetch only when the appended row does not line up with it
+		if not self.apply_append(sheet, row, result.get('updates', {})):
+			self.get_cache()
 		return result
 
+	def apply_append(self, sheet, row, updates):
+		return False
+
+	@check_creds
+	def get_file_version(self):
+		"""Returns the Drive version of the spreadsheet, it increases with every change."""
+		response = self.drive.files().get(fileId=self.spreadsheet_id, fields='version').execute()
+		return response['version']
+
+	def refresh_cache(self):
+		"""Reloads the cache unless the spreadsheet is unchanged since it was loaded.
+
+			Returns True when the cache was reloaded.
+		"""
+		version = self.get_file_version()
+		snapshot = type(self).snapshot
+		# New sheets seen by get_sheet_names are only read by a reload
+		if snapshot is not None and version == snapshot.version and not self.sheets_changed(snapshot):
+			return False
+
+		self.get_cache(version)
+		return True
+
+	def _budgeted(self, search, plan, *args):
+		"""Returns search(plan, *args), matching literally when the regex search times out."""
+		self.notice = plan.notice
+		try:
+			return search(time.monotonic() + REGEX_SEARCH_BUDGET, plan, *args)
+		except SearchTimeout:
+			plan = plan.degrade()
+			self.notice = plan.notice
+			print(plan.notice)
+			return search(None, plan, *args)
+
 	@check_creds
 	def get_sheet_info(self):
 		response = self.sheets.get(
@@ -87,7 +116,73 @@ class GoogleService:
 
 	def get_sheet_names(self):
 		sheets = self.get_sheet_info()
-		return [sheet['title'] for sheet in sheets]
+		type(self).sheet_names = [sheet['title'] for sheet in sheets]
+		return type(self).sheet_names
+
+	def sheets_changed(self, snapshot):
+		"""True when sheet_names has sheets the cache was not loaded from."""
+		return False
+
+	@check_creds
+	def iter_sheet_values(self, columns, sheets=None, fallback=None, window=SHEET_WINDOW_ROWS):
+		"""Reads the same columns of several sheets, `window` rows at a time.
+
+			Every request reads the next window of all sheets that have rows
+			left, so only one window per sheet is held in memory. Yields
+			(sheet title, first row number, rows) for every window of every
+			sheet, sheets in order within a window. The rows are like
+			values().get returns them: header included, trailing empty cells
+			and rows dropped.
+
+			Args:
+				columns: A1 column range like 'A:D'.
+				sheets: titles of the sheets to read, a None title reads the
+					first sheet. Without titles every sheet is read.
+				fallback: sheets read instead when one of `sheets` was
+					renamed or deleted, every sheet when None.
+				window: number of rows read per sheet and request.
+		"""
+		first_column, _, last_column = columns.partition(':')
+		pending = sheets or self.get_sheet_names()
+		start = 1
+
+		while pending:
+			cells = f'{first_column}{start}:{last_column}{start + window - 1}'
+			ranges = [a1_range(sheet, cells) for sheet in pending]
+			try:
+				response = self.sheets.get(
+						spreadsheetId=self.spreadsheet_id,
+						ranges=ranges,
+						# Only the values, a full sheets.get response repeats the formatting of every cell
+						fields='sheets(properties(title,gridProperties/rowCount),'
+								'data(startRow,rowData/values/formattedValue))').execute()
+			except googleapiclient.errors.HttpError as e:
+				# Only titles passed in can be out of date, and only before the first window
+				if e.resp.status != 400 or start != 1 or not sheets:
+					raise
+				print(f"Could not read {ranges}, a sheet was renamed or deleted: {e}")
+				sheets = None
+				pending = fallback or self.get_sheet_names()
+				continue
+
+			pending = []
+			for sheet in response.get('sheets', []):
+				properties = sheet['properties']
+				# Sheets without values in the window come without data
+				for data in sheet.get('data') or [{}]:
+					rows = []
+					for row_data in data.get('rowData', []):
+						row = [cell.get('formattedValue', '') for cell in row_data.get('values', [])]
+						while row and not row[-1]:
+							row.pop()
+						rows.append(row)
+					while rows and not rows[-1]:
+						rows.pop()
+					yield properties['title'], data.get('startRow', 0) + 1, rows
+
+				if start + window <= properties.get('gridProperties', {}).get('rowCount', 0):
+					pending.append(properties['title'])
+			start += window
 
 	@check_creds
 	def get_sheet_data(self, sheet, _range):
@@ -232,7 +327,9 @@ class GoogleService:
 
 
 class UnrealService(GoogleService):
-	cache = None
+	# Published Snapshot of the assets sheet, see snapshot.Snapshot
+	snapshot = None
+	_write_lock = threading.RLock()
 
 	def __init__(self, spreadsheet_id):
 		super().__init__()
@@ -240,36 +337,111 @@ class UnrealService(GoogleService):
 
 	def authenticate(self):
 		super().authenticate()
-		if UnrealService.cache is None:
+		if UnrealService.snapshot is None and not self.load_cache():
 			self.get_cache()
 
 	@check_creds
 	def search(self, query):
-		result = []
+		snapshot = UnrealService.snapshot
+		cache = snapshot.rows
+		filters, query = parse_facets(query)
 
-		for row in UnrealService.cache:
-			if re.search(query, row[2], re.IGNORECASE):
-				result.append(row)
+		if query.startswith(FUZZY_PREFIX):
+			ids = snapshot.fuzzy.search(query[len(FUZZY_PREFIX):], FUZZY_SEARCH_BUDGET)
+			if filters:
+				allowed = set(snapshot.facets.select(filters))
+				ids = [i for i in ids if i in allowed]
+			return [cache[i].as_list() for i in ids]
 
-		for row in UnrealService.cache:
-			if re.search(query, row[3], re.IGNORECASE) and row not in result:
-				result.append(row)
+		if filters:
+			cache = [cache[i] for i in snapshot.facets.select(filters)]
+			if not query:
+				return [row.as_list() for row in cache]
 
-		return result
+		return self._budgeted(self._rank, plan_query(query), cache)
+
+	def _rank(self, deadline, plan, rows):
+		if deadline is not None and plan.kind == plan.REGEX:
+			rows = within_budget(rows, deadline)
+		# Name hits outrank tag hits
+		return [row.as_list() for row in rank_fields(rows, plan, [('name', 2), ('tags', 1)])]
 
 
 	@check_creds
-	def get_cache(self):
-		sheets = self.get_sheet_names()
-		if not sheets:
+	def get_cache(self, version=None):
+		# Read the version first so changes made during the load are picked up by the next refresh
+		version = version or self.get_file_version()
+		# The assets are on the first sheet, a range without sheet name reads it
+		names = UnrealService.sheet_names
+		sheet = None
+		cache = []
+		for sheet, first_row, values in self.iter_sheet_values('A:F', names[:1] if names else [None], fallback=[None]):
+			# Skip the header
+			cache.extend(AssetRow(*row[:6]) for row in (values[1:] if first_row == 1 else values))
+		if sheet is None:
 			raise ValueError(f"Could not retrive sheet names from Sprreadsheet: {self.spreadsheet_id}")
 
-		sheet = sheets[0]
-		UnrealService.cache = self.get_sheet_data(sheet, 'A:F')
+		names = TextIndex(row.name_key for row in cache)
+		self._publish(Snapshot(cache, version,
+				sheet=sheet,
+				names=names,
+				facets=FacetIndex(cache),
+				fuzzy=FuzzyIndex(names.tokens)))
+
+	def sheets_changed(self, snapshot):
+		names = UnrealService.sheet_names
+		return bool(names) and names[0] != snapshot.sheet
+
+	def apply_append(self, sheet, row, updates):
+		updated_sheet, first_row = parse_a1_range(updates.get('updatedRange', ''))
+
+		with UnrealService._write_lock:
+			snapshot = UnrealService.snapshot
+
+			# The header is row 1 and every sheet row after it is cached
+			if snapshot is None or updates.get('updatedRows') != 1:
+				return False
+			if updated_sheet != snapshot.sheet or first_row != len(snapshot.rows) + 2:
+				return False
+
+			row = AssetRow(*row[:6])
+			names = snapshot.names.copy()
+			facets = snapshot.facets.copy()
+			fuzzy = snapshot.fuzzy.copy(names.tokens)
+			fuzzy.add_words(names.add(row.name_key))
+			facets.add(row)
+			# Not saved, the append changed the file version so the next refresh reloads and saves
+			self._publish(snapshot.replace(rows=snapshot.rows + [row], names=names, facets=facets, fuzzy=fuzzy), save=False)
+		return True
+
+	def _publish(self, snapshot, save=True):
+		with UnrealService._write_lock:
+			UnrealService.snapshot = snapshot
+			if save:
+				save_snapshot('assets', self.spreadsheet_id, snapshot)
+
+	def load_cache(self):
+		snapshot = load_snapshot('assets', self.spreadsheet_id)
+		if snapshot is None:
+			return False
+
+		UnrealService.snapshot = snapshot
+		return True
 
 
 class NotesService(GoogleService):
-	cache = None
+	# Published Snapshot of all note sheets, see snapshot.Snapshot
+	snapshot = None
+	_write_lock = threading.RLock()
+	results = ResultCache(SEARCH_RESULT_CACHE_SIZE)
+	# Bodies of the linked documents, filled by index_documents
+	documents = DocumentStore(DOCUMENTS_FILE)
+	# (generation, {document id: row ids}) of the snapshot last searched for document hits
+	_linked = (None, {})
+	# Generation of the snapshot whose linked documents were last indexed completely
+	_indexed = None
+	# (generation, {row: row ids}) of the snapshot last refined in, see _search_within
+	_positions = (None, {})
 
 	def __init__(self, spreadsheet_id):
 		super().__init__()
@@ -277,20 +449,54 @@ class NotesService(GoogleService):
 
 	def authenticate(self):
 		super().authenticate()
-		if NotesService.cache is None:
-			self.get_cache()
+		# Without a saved cache the sheets are loaded by refresh_cache, which
+		# publishes the rows read so far for searches to run on
+		if NotesService.snapshot is None:
+			self.load_cache()
 
 
 	@check_creds
-	def search(self, query, sheets=[]):
+	def search(self, query, sheets=[], within=None, generation=None, interrupted=lambda: False):
+		"""Searches the note titles.
+
+		`within` may hold the rows found by an earlier query that `query`
+		refines on the snapshot of `generation`, only those rows are
+		searched then. Rows of another snapshot are ignored. Raises
+		SearchInterrupted once `interrupted` returns True.
+		"""
 
 		result = []
+		plan = plan_query(query)
+		snapshot = NotesService.snapshot
+		self.interrupted = interrupted
+		# True or False when the result cache was looked up, see ResultCache.stats
+		self.cache_hit = None
+		# Partial snapshots published by get_cache have no version, the next one has more rows
+		loading = snapshot is not None and snapshot.version is None
+		current = None if snapshot is None else snapshot.generation
+
+		if within is not None and not loading and generation == current:
+			return self._budgeted(self._search_within, plan, within, sheets)
+
+		if loading:
+			result = self._budgeted(self._search_snapshot, plan, snapshot, query, sheets)
+			self.notice = ' '.join(filter(None, [self.notice, "Sheets are still loading, results may be incomplete"]))
+			return result
 
-		if NotesService.cache is not None:
-			for row in NotesService.cache:
-				if not sheets or row[0].lower() in [_.lower() for _ in sheets]:
-					if re.search(query, row[2], re.IGNORECASE):
-						result.append(row)
+		if snapshot is not None:
+			# Document hits change with the document store as well
+			generation = snapshot.generation, NotesService.documents.generation
+			key = result_key(query, sheets)
+			cached = NotesService.results.get(generation, key)
+			self.cache_hit = cached is not None
+			if cached is not None:
+				result, self.notice = cached
+				return result
+
+			result = self._budgeted(self._search_snapshot, plan, snapshot, query, sheets)
+			# A search that timed out may finish the next time, keep only complete ones
+			if self.notice == plan.notice:
+				NotesService.results.put(generation, key, result, self.notice)
 			return result
 
 		# Get sheet names
@@ -314,14 +520,229 @@ class NotesService(GoogleService):
 					if len(row) < 2:
 						continue
 
-					if re.search(query, row[1], re.IGNORECASE):
+					if plan.match(row[1]):
 						link = '' if len(row) < 3 else row[2]
 						code_link = '' if len(row) < 4 else row[2]
 						result.append([sheet_name, row[0], row[1], link, code_link])
 					
 		return result[::-1]
 
-		
+
+	def _search_within(self, deadline, plan, rows, sheets):
+		sheets = {normalize(_) for _ in sheets}
+		snapshot = NotesService.snapshot
+		if snapshot is not None:
+			# The earlier result is ranked, restore the sheet order a fresh search ranks from
+			positions = self._row_positions(snapshot)
+			# Equal rows take their row ids in turn
+			taken = Counter()
+			def position(row):
+				row = tuple(row)
+				ids = positions.get(row, ())
+				taken[row] += 1
+				return ids[taken[row] - 1] if taken[row] <= len(ids) else len(snapshot.rows)
+			rows = sorted(rows, key=position)
+
+		rows = within_budget(rows, deadline if plan.kind == plan.REGEX else None, self.interrupted)
+		rows = [row for row in rows if not sheets or normalize(row[0]) in sheets]
+		result = [row for row in rows if plan.match(row[2])]
+
+		if snapshot is not None:
+			result = snapshot.ranking.rank(result, plan.terms, lambda row: (normalize(row[2]), normalize(row[1])), RANK_TOP_K)
+
+		documents = self._document_hits(plan)
+		if documents:
+			found = {tuple(row) for row in result}
+			result += [row for row in rows if tuple(row) not in found
+					and (document_id(row[3]) in documents or document_id(row[4]) in documents)]
+		return result
+
+	def _search_snapshot(self, deadline, plan, snapshot, query, sheets):
+		result = []
+		cache = snapshot.rows
+		sheets = {normalize(_) for _ in sheets}
+		ids = None
+
+		if query.startswith(FUZZY_PREFIX):
+			ids = snapshot.fuzzy.search(query[len(FUZZY_PREFIX):], FUZZY_SEARCH_BUDGET)
+			return [cache[i].as_list() for i in ids if not sheets or cache[i].sheet_key in sheets]
+
+		if plan.kind != plan.REGEX:
+			ids = snapshot.index.candidates(plan.text)
+		else:
+			ids = regex_search(snapshot, plan.query, deadline, self.interrupted)
+			if ids is not None:
+				return [cache[i].as_list() for i in ids if not sheets or cache[i].sheet_key in sheets]
+		rows = cache if ids is None else (cache[i] for i in ids)
+		rows = within_budget(rows, deadline if plan.kind == plan.REGEX else None, self.interrupted)
+
+		for row in rows:
+			if not sheets or row.sheet_key in sheets:
+				if plan.match(row.title, row.title_key):
+					result.append(row)
+
+		result = snapshot.ranking.rank(result, plan.terms, lambda row: (row.title_key, row.category_key), RANK_TOP_K)
+
+		# Rows whose documents contain the query follow the title hits
+		documents = self._document_hits(plan)
+		if documents:
+			found = set(result)
+			linked = self._linked_rows(snapshot)
+			ids = sorted({i for doc_id in documents for i in linked.get(doc_id, ())})
+			result += [cache[i] for i in ids
+					if cache[i] not in found and (not sheets or cache[i].sheet_key in sheets)]
+
+		return [row.as_list() for row in result]
+
+	def _document_hits(self, plan):
+		"""Returns the ids of the stored documents containing a literal query."""
+		if plan.kind != plan.LITERAL or not plan.text.strip():
+			return set()
+		return NotesService.documents.search(plan.text)
+
+	def _row_positions(self, snapshot):
+		generation, positions = NotesService._positions
+		if generation != snapshot.generation:
+			# Records hash and compare like the row lists handed to the UI
+			positions = defaultdict(list)
+			for i, row in enumerate(snapshot.rows):
+				positions[row].append(i)
+			NotesService._positions = snapshot.generation, positions
+		return positions
+
+	def _linked_rows(self, snapshot):
+		generation, linked = NotesService._linked
+		if generation != snapshot.generation:
+			linked = defaultdict(list)
+			for i, row in enumerate(snapshot.rows):
+				for doc_id in {document_id(row.link), document_id(row.code_link)} - {None}:
+					linked[doc_id].append(i)
+			NotesService._linked = snapshot.generation, linked
+		return linked
+
+	@check_creds
+	def get_document_versions(self, ids, listing=True):
+		"""Returns the Drive versions of the Google Docs with the given ids.
+
+			Documents that can not be read are left out.
+
+			Args:
+				ids: the document ids.
+				listing: list every document of the user, in pages of 1000,
+					instead of looking the ids up one by one. Cheaper for
+					many ids.
+		"""
+		ids = set(ids)
+		versions = {}
+
+		if listing:
+			request = self.drive.files().list(
+					q="mimeType='application/vnd.google-apps.document' and trashed=false",
+					fields='nextPageToken, files(id, version)',
+					pageSize=1000)
+
+			while request is not None and len(versions) < len(ids):
+				response = request.execute()
+				for document in response.get('files', []):
+					if document['id'] in ids:
+						versions[document['id']] = document['version']
+				request = self.drive.files().list_next(request, response)
+
+		def collect(doc_id, response, exception):
+			if exception is None:
+				versions[doc_id] = response['version']
+			else:
+				print(f"Skipping document {doc_id}: {exception}")
+
+		# Documents shared by link only are not listed. Batches take up to 100 requests.
+		missing = sorted(ids - set(versions))
+		for start in range(0, len(missing), 100):
+			batch = self.drive.new_batch_http_request(callback=collect)
+			for doc_id in missing[start:start + 100]:
+				batch.add(self.drive.files().get(fileId=doc_id, fields='version'), request_id=doc_id)
+			batch.execute()
+		return versions
+
+	@check_creds
+	def index_documents(self, interrupted=lambda: False):
+		"""Stores the text of the documents linked from the notes sheets in NotesService.documents.
+
+			Only documents whose Drive version changed since they were stored
+			are fetched. Nothing is looked up while the snapshot is the one
+			indexed last, documents edited since are brought up to date by
+			prefetch_documents when they are shown. Returns the number of
+			fetched documents.
+
+			Args:
+				interrupted: returns True when indexing should stop early.
+		"""
+		store = NotesService.documents
+		store.load()
+		snapshot = NotesService.snapshot
+		if snapshot is None or snapshot.generation == NotesService._indexed:
+			return 0
+
+		linked = set(self._linked_rows(snapshot))
+		for doc_id in store.ids() - linked:
+			store.discard(doc_id)
+
+		fetched, failed = self._fetch_documents(self.get_document_versions(linked), interrupted)
+		# Documents that failed are retried by the next run
+		if not failed and not interrupted():
+			NotesService._indexed = snapshot.generation
+		return fetched
+
+	def prefetch_documents(self, urls, interrupted=lambda: False):
+		"""Brings the stored text of the documents behind `urls` up to date, see index_documents."""
+		NotesService.documents.load()
+		ids = {document_id(url) for url in urls} - {None}
+		if not ids:
+			return 0
+		return self._fetch_documents(self.get_document_versions(ids, listing=False), interrupted)[0]
+
+	def _fetch_documents(self, versions, interrupted):
+		"""Returns the number of fetched documents and of documents that could not be fetched."""
+		store = NotesService.documents
+		fetched = failed = 0
+
+		try:
+			for doc_id, version in versions.items():
+				if interrupted():
+					break
+				if store.version(doc_id) == version:
+					continue
+
+				try:
+					self._fetch_document(doc_id, version)
+				except googleapiclient.errors.HttpError as e:
+					print(f"Could not fetch document {doc_id}: {e}")
+					failed += 1
+					continue
+				fetched += 1
+		finally:
+			# Written once, also when offline midway, rewriting the whole store per batch is quadratic
+			if fetched:
+				store.save()
+		return fetched, failed
+
+	@backoff.on_exception(backoff.expo,
+						  googleapiclient.errors.HttpError,
+						  max_tries=4,
+						  giveup=lambda e: e.resp.status not in RETRIED_STATUSES)
+	def _fetch_document(self, doc_id, version=None):
+		"""Returns the text of a document and stores it when its `version` is known."""
+		doc = self.docs.get(documentId=doc_id).execute()
+		text = read_strucutural_elements(doc.get('body', {}).get('content', []))
+		if version is not None:
+			NotesService.documents.put(doc_id, version, text)
+		return text
+
+	@staticmethod
+	def stored_document_text(url):
+		"""Returns the stored text of the document behind `url`, or None."""
+		doc_id = document_id(url)
+		return NotesService.documents.text(doc_id) if doc_id else None
+
 	@check_creds
 	def _create_code_document(self, title, code):
 		if code:
@@ -429,77 +850,186 @@ class NotesService(GoogleService):
 	@check_creds
 	def get_document_text(self, url):
 
-		match = re.search('document/d/([^/]+)', url)
-		if not match:
+		id_ = document_id(url)
+		if not id_:
 			print(f"Could not parse document url: {url}")
 			return
 
-		id_ = match.group(1)
-		doc = self.docs.get(documentId=id_).execute()
-		return read_strucutural_elements(doc.get('body').get('content'))
+		# The stored text is used as long as the document revision is unchanged
+		store = NotesService.documents
+		store.load()
+		version = self.get_document_versions([id_], listing=False).get(id_)
+		if version is not None and store.version(id_) == version:
+			return store.text(id_)
+
+		text = self._fetch_document(id_, version)
+		if version is not None:
+			store.save()
+		return text
 
 	@check_creds
-	def get_cache(self):
+	def get_cache(self, version=None):
+
+		# Read the version first so changes made during the load are picked up by the next refresh
+		version = version or self.get_file_version()
+		# Records per sheet, the windows of all sheets arrive interleaved
+		records = {}
+		row_counts = {}
+		publish_size = SHEET_WINDOW_ROWS
+
+		for sheet_name, first_row, values in self.iter_sheet_values('A:D', NotesService.sheet_names):
+			sheet_records = records.setdefault(sheet_name, [])
+			row_counts.setdefault(sheet_name, 0)
+			if values:
+				row_counts[sheet_name] = first_row + len(values) - 1
+
+			# Skip the header
+			for row in values[1:] if first_row == 1 else values:
+				record = note_record(sheet_name, row)
+				if record:
+					sheet_records.append(record)
+
+			# Without a complete cache, searches run on the rows read so far.
+			# Publishing whenever the rows doubled keeps the index builds linear.
+			size = sum(len(_) for _ in records.values())
+			if size >= publish_size and (NotesService.snapshot is None or NotesService.snapshot.version is None):
+				self._publish(self._build_snapshot(records, None, {}), save=False)
+				publish_size = size * 2
+
+		self._publish(self._build_snapshot(records, version, row_counts))
+
+	@staticmethod
+	def _build_snapshot(records, version, row_counts):
+		result = [record for sheet_records in records.values() for record in sheet_records]
+		index = TextIndex(row.title_key for row in result)
+		# row_counts holds the number of the last row of every sheet, header included.
+		# Partial snapshots published during a load have no version and no row counts.
+		return Snapshot(result, version,
+				row_counts=row_counts,
+				index=index,
+				fuzzy=FuzzyIndex(index.tokens),
+				ranking=BM25Index(result))
+
+	def sheets_changed(self, snapshot):
+		names = NotesService.sheet_names
+		return names is not None and names != list(snapshot.row_counts)
+
+	def apply_append(self, sheet, row, updates):
+		updated_sheet, first_row = parse_a1_range(updates.get('updatedRange', ''))
+
+		with NotesService._write_lock:
+			snapshot = NotesService.snapshot
+
+			# An append into an empty sheet would land on the header row
+			if snapshot is None or updates.get('updatedRows') != 1:
+				return False
+			if not snapshot.row_counts.get(updated_sheet) or first_row != snapshot.row_counts[updated_sheet] + 1:
+				return False
+
+			changes = {'row_counts': {**snapshot.row_counts, updated_sheet: first_row}}
+			record = note_record(updated_sheet, row)
+			if record:
+				index = snapshot.index.copy()
+				fuzzy = snapshot.fuzzy.copy(index.tokens)
+				fuzzy.add_words(index.add(record.title_key))
+				ranking = snapshot.ranking.copy()
+				ranking.add(record)
+				changes.update(rows=snapshot.rows + [record], index=index, fuzzy=fuzzy, ranking=ranking)
+			# Not saved, the append changed the file version so the next refresh reloads and saves
+			self._publish(snapshot.replace(**changes), save=False)
+		return True
+
+	def _publish(self, snapshot, save=True):
+		with NotesService._write_lock:
+			NotesService.snapshot = snapshot
+			if save:
+				save_snapshot('notes', self.spreadsheet_id, snapshot)
+
+	def load_cache(self):
+		snapshot = load_snapshot('notes', self.spreadsheet_id)
+		if snapshot is None:
+			return False
+
+		NotesService.snapshot = snapshot
+		if NotesService.sheet_names is None:
+			NotesService.sheet_names = list(snapshot.row_counts)
+		return True
 
-		result = []
-		# Get sheet names
-		sheets = self.get_sheet_names()
-		# Build the ranges expression ["sheet1!A:C", "sheet2!A:C", "sheet3!A:C"]
-		ranges = [sheet + '!A:D' for sheet in sheets]
 
-		values = self.sheets.values().batchGet(spreadsheetId=self.spreadsheet_id, ranges=ranges).execute()
 
-		for sheet in values['valueRanges']:
-			if sheet.get('values'):
-				sheet_name = sheet['range'].split('!')[0]
 
-				# remove unnecessary quote signs
-				if sheet_name.startswith("'") and sheet_name.endswith("'"):
-					sheet_name = sheet_name[1:-1]
 
-				for row in sheet['values'][1:]:
-					# Only category is given.
-					if len(row) < 2:
-						continue
+# helper functions
 
-					link = '' if len(row) < 3 else row[2]
-					code_link = '' if len(row) < 4 else row[3]
-					result.append([sheet_name, row[0], row[1], link, code_link])
+def a1_range(sheet, cells):
+	"""Returns the A1 range of `cells` in `sheet`, quoted. A None sheet means the first sheet."""
+	if sheet is None:
+		return cells
+	return "'" + sheet.replace("'", "''") + "'!" + cells
 
-		NotesService.cache = result
+def parse_a1_range(a1_range):
+	"""Returns the sheet name and first row number of an A1 range like 'My Sheet'!A12:D12.
 
+		The row number is None when the range has no row part.
+	"""
+	sheet_name, _, cells = a1_range.rpartition('!')
 
+	# remove unnecessary quote signs
+	if sheet_name.startswith("'") and sheet_name.endswith("'"):
+		sheet_name = sheet_name[1:-1].replace("''", "'")
 
+	match = re.match(r'[A-Za-z]*(\d+)', cells)
+	return sheet_name, int(match.group(1)) if match else None
 
+def note_record(sheet_name, row):
+	"""Converts a [category, title, link, code_link] sheet row to a cache row."""
+	# Only category is given.
+	if len(row) < 2:
+		return None
 
-# helper functions
+	# Rows appended by create_doc hold None for a missing code document
+	row = ['' if value is None else value for value in row]
+	link = '' if len(row) < 3 else row[2]
+	code_link = '' if len(row) < 4 else row[3]
+	return NoteRow(sheet_name, row[0], row[1], link, code_link)
 
 def read_strucutural_elements(elements):
-	"""Recurses through a list of Structural Elements to read a document's text where text may be
+	"""Reads a document's text from a list of Structural Elements where text may be
 		in nested elements.
 
 		Args:
 			elements: a list of Structural Elements.
 	"""
-	text = ''
-	for value in elements:
-		if 'paragraph' in value:
-			elements = value.get('paragraph').get('elements')
-			for elem in elements:
-				text += read_paragraph_element(elem)
+	return ''.join(iter_structural_text(elements))
+
+def iter_structural_text(elements):
+	"""Yields the text fragments of a list of Structural Elements in document order.
+
+		Nested elements are walked with an explicit stack instead of recursion,
+		so deeply nested tables can not exhaust the recursion limit.
+
+		Args:
+			elements: a list of Structural Elements.
+	"""
+	stack = [iter(elements)]
+	while stack:
+		value = next(stack[-1], None)
+		if value is None:
+			stack.pop()
+		elif 'paragraph' in value:
+			yield from map(read_paragraph_element, value.get('paragraph').get('elements'))
 		elif 'table' in value:
 			# The text in table cells are in nested Structural Elements and tables may be
 			# nested.
 			table = value.get('table')
-			for row in table.get('tableRows'):
-				cells = row.get('tableCells')
-				for cell in cells:
-					text += read_strucutural_elements(cell.get('content'))
+			stack.append(element
+					for row in table.get('tableRows')
+					for cell in row.get('tableCells')
+					for element in cell.get('content'))
 		elif 'tableOfContents' in value:
 			# The text in the TOC is also in a Structural Element.
 			toc = value.get('tableOfContents')
-			text += read_strucutural_elements(toc.get('content'))
-	return text
+			stack.append(iter(toc.get('content')))
 
 def read_paragraph_element(element):
     """Returns the text in the given ParagraphElement.
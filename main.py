@@ -1,4 +1,5 @@
 import sys
+from multiprocessing import freeze_support
 
 from PyQt5.QtWidgets import QApplication
 from qt5.controller import SheetsController
@@ -13,4 +14,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Required by the search process pool in frozen Windows builds
+    freeze_support()
     main()
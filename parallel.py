@@ -0,0 +1,162 @@
+import os
+import time
+import atexit
+import functools
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+import saferegex
+from config import PARALLEL_SEARCH_THRESHOLD, PARALLEL_SEARCH_WORKERS
+from search import SearchTimeout, SearchInterrupted
+
+# Titles are shipped to the worker processes as one '\0' separated UTF-8 block
+SEPARATOR = '\0'
+# Seconds between checks for a timed out or interrupted search
+POLL_INTERVAL = 0.05
+
+_lock = threading.Lock()
+_pool = None
+_block = None
+_block_size = 0
+_block_generation = None
+
+# Worker process side: the decoded titles of the last attached block
+_titles_name = None
+_titles = None
+
+
+def _attach(name, size):
+	global _titles_name, _titles
+
+	if name != _titles_name:
+		# The pool shares the resource tracker of the main process, which
+		# unlinks the block
+		block = shared_memory.SharedMemory(name=name)
+		try:
+			_titles = bytes(block.buf[:size]).decode('utf-8').split(SEPARATOR)
+		finally:
+			block.close()
+		_titles_name = name
+	return _titles
+
+
+@functools.lru_cache(maxsize=32)
+def _compile(pattern):
+	return saferegex.compile(saferegex.parse(pattern))
+
+
+def _search_shard(name, size, start, end, pattern):
+	titles = _attach(name, size)
+	search = _compile(pattern).search
+	return [i for i in range(start, end) if search(titles[i])]
+
+
+def _workers():
+	return PARALLEL_SEARCH_WORKERS or os.cpu_count() or 1
+
+
+def _publish(snapshot):
+	"""Copies the titles of `snapshot` to shared memory, once per generation.
+
+	Returns False when the titles can not be shipped as one block.
+	"""
+	global _block, _block_size, _block_generation
+
+	if _block_generation == snapshot.generation:
+		return True
+
+	data = SEPARATOR.join(row.title for row in snapshot.rows).encode('utf-8')
+	if data.count(SEPARATOR.encode()) != len(snapshot.rows) - 1:
+		return False
+
+	block = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+	block.buf[:len(data)] = data
+
+	_release()
+	_block, _block_size, _block_generation = block, len(data), snapshot.generation
+	return True
+
+
+def _release():
+	global _block, _block_generation
+
+	if _block is not None:
+		_block.close()
+		_block.unlink()
+	_block, _block_generation = None, None
+
+
+def _shutdown():
+	global _pool
+
+	with _lock:
+		if _pool is not None:
+			_pool.terminate()
+			_pool = None
+		_release()
+
+
+atexit.register(_shutdown)
+
+
+def _terminate(pool):
+	# Queued shards could be dropped, running ones only stop with their process
+	global _pool
+	with _lock:
+		pool.terminate()
+		if _pool is pool:
+			_pool = None
+
+
+def regex_search(snapshot, pattern, deadline=None, interrupted=lambda: False):
+	"""Returns the ids of the rows whose title matches `pattern`, in row order.
+
+	`pattern` is a query saferegex can parse. The rows are split in one
+	shard per worker of a process pool that is kept warm between queries.
+	Returns None when the snapshot is smaller than
+	PARALLEL_SEARCH_THRESHOLD or the pool is not usable, the caller scans
+	the rows itself then. Raises SearchTimeout when the shards are not
+	done by time.monotonic() `deadline`, the pool is terminated then so
+	no shard keeps running. Likewise raises SearchInterrupted once
+	`interrupted` returns True.
+	"""
+	global _pool
+
+	rows = len(snapshot.rows)
+	if PARALLEL_SEARCH_THRESHOLD is None or rows < PARALLEL_SEARCH_THRESHOLD:
+		return None
+
+	with _lock:
+		try:
+			if not _publish(snapshot):
+				return None
+			# Created after the block, so the workers inherit the resource
+			# tracker of this process and terminating them never unlinks it
+			if _pool is None:
+				_pool = multiprocessing.Pool(_workers())
+			pool, name, size = _pool, _block.name, _block_size
+
+			step = -(-rows // _workers())
+			results = [pool.apply_async(_search_shard, (name, size, start, min(start + step, rows), pattern))
+					for start in range(0, rows, step)]
+		except OSError as e:
+			print(f"Parallel search unavailable: {e}")
+			return None
+
+	try:
+		ids = []
+		for result in results:
+			while not result.ready():
+				if interrupted():
+					_terminate(pool)
+					raise SearchInterrupted()
+				if deadline is not None and time.monotonic() > deadline:
+					_terminate(pool)
+					raise SearchTimeout()
+				result.wait(POLL_INTERVAL)
+			ids.extend(result.get())
+		return ids
+	except OSError as e:
+		# The block was replaced by a newer snapshot while the shards ran
+		print(f"Parallel search failed: {e}")
+		return None
@@ -1,16 +1,21 @@
 import os
 import json
+import time
 from pathlib import Path
+from PyQt5.QtCore import QTimer
 from gsuite import NotesService, GoogleService
+from search import refines
 from qt5.ui import alert_dialog, AddRecordUI, AssetResults, DownloadAsset, AddNewAsset, ScanningUI
 from qt5.workers import GoogleServiceWorker, ScanProjectsWorker, AssetsDownloaderWorker
-from config import SETTINGS_FILE, TOPICS_FILE
+from config import SETTINGS_FILE, TOPICS_FILE, LIVE_SEARCH_DELAY, CACHE_REFRESH_INTERVAL, CACHE_REFRESH_MAX_INTERVAL, CODE_PREFETCH_LIMIT
 
 class SheetsController():
     def __init__(self, view, settings):
         self._view = view
         self._settings_view = settings
         self._init_settings()
+        self._init_live_search()
+        self._init_cache_scheduler()
         self._check_login()
         self._view.add_table_columns(['Title', 'Cateogry', 'Code'])
         # Connect signals and slots
@@ -80,8 +85,65 @@ class SheetsController():
         self.worker.recordsDone.connect(self._init_topics)
         self.worker.start()
 
+    def _init_live_search(self):
+        self.live_worker = None
+        self._live_pending = False
+        self._reset_live_search()
+        self._live_timer = QTimer()
+        self._live_timer.setSingleShot(True)
+        self._live_timer.setInterval(LIVE_SEARCH_DELAY)
+        self._live_timer.timeout.connect(self._live_search)
+
+    def _reset_live_search(self):
+        self._live_query = None
+        self._live_topics = None
+        self._live_rows = None
+        self._live_generation = None
+
+    def _live_search(self):
+        query = self._view.get_search_text()
+
+        if not query or not hasattr(self, '_sheets'):
+            return
+
+        # Never queue more than one search behind the running one
+        if self.live_worker is not None and self.live_worker.isRunning():
+            self.live_worker.requestInterruption()
+            self._live_pending = True
+            return
+
+        topics = [s for s in self._sheets if s not in self.settings['excludeSheets']]
+        within = None
+        if self._live_rows and topics == self._live_topics and refines(self._live_query, query):
+            within = self._live_rows
+
+        # The search refuses rows kept from an older snapshot
+        snapshot = NotesService.snapshot
+        generation = None if snapshot is None else snapshot.generation
+        self.live_worker = GoogleServiceWorker(self.settings['sheetId'], "search",
+                (query, topics, within, self._live_generation))
+        self.live_worker.log.connect(self._logger)
+        self.live_worker.recordsDone.connect(lambda rows: self._live_search_done(query, topics, rows, generation))
+        self.live_worker.finished.connect(self._live_search_finished)
+        self.live_worker.start()
+
+    def _live_search_done(self, query, topics, rows, generation):
+        self._live_query = query
+        self._live_topics = topics
+        self._live_rows = rows
+        self._live_generation = generation
+
+        if query == self._view.get_search_text():
+            self._add_rows(rows)
+
+    def _live_search_finished(self):
+        if self._live_pending:
+            self._live_pending = False
+            self._live_search()
+
     def _handle_search(self):
         query = self._view.get_search_text()
+        self._live_timer.stop()
 
         if query:
             self._view.start_spinner()
@@ -107,13 +169,35 @@ class SheetsController():
         self._settings_view.set_setting('activeTopics', current_topics)
         self._save_settings()
 
+        code_links = []
         if self.data:
             for row in self.data:
                 topic, category, title, link, code_link = row
                 category = f'[{topic}] ' + category
                 if current_topics == [] or topic.lower() in current_topics:
                     self._view.addRow([title, category, code_link], link)
+                    if code_link and len(code_links) < CODE_PREFETCH_LIMIT:
+                        code_links.append(code_link)
         self._view.stop_spinner()
+        self._prefetch_code(code_links)
+
+    def _prefetch_code(self, code_links):
+        # Copying the code of a shown result is then a local clipboard write
+        if not code_links:
+            return
+
+        if self.prefetch_worker is not None and self.prefetch_worker.isRunning():
+            self.prefetch_worker.requestInterruption()
+            self._prefetch_pending = code_links
+            return
+
+        self.prefetch_worker = GoogleServiceWorker(self.settings['sheetId'], "prefetch_documents", code_links)
+        self.prefetch_worker.finished.connect(self._prefetch_finished)
+        self.prefetch_worker.start()
+
+    def _prefetch_finished(self):
+        code_links, self._prefetch_pending = self._prefetch_pending, None
+        self._prefetch_code(code_links)
 
     def _init_topics(self, sheets):
         self._sheets = sheets
@@ -128,6 +212,75 @@ class SheetsController():
         self._settings_view.set_settings(self.settings, sheets)
         #self._view.populate_topic_dropdowns(filtered_sheets)
         self._view.stop_spinner()
+        self._revalidate_cache()
+
+    def _init_cache_scheduler(self):
+        self.cache_worker = None
+        self.index_worker = None
+        self.prefetch_worker = None
+        self._prefetch_pending = None
+        # Consecutive failed refreshes per service, each backs off on its own
+        self._cache_failures = {'notes': 0, 'assets': 0}
+        self._assets_retry_at = 0
+        self._refreshing = set()
+        self._failed_services = set()
+        self._cache_timer = QTimer()
+        self._cache_timer.setSingleShot(True)
+        self._cache_timer.timeout.connect(lambda: self._revalidate_cache(quiet=True))
+
+    def _base_refresh_interval(self):
+        return self.settings.get('cacheRefreshInterval', CACHE_REFRESH_INTERVAL) * 1000
+
+    def _refresh_interval(self, service):
+        # Most likely offline, back off
+        failures = min(self._cache_failures[service], 16)
+        return min(self._base_refresh_interval() * 2 ** failures, CACHE_REFRESH_MAX_INTERVAL * 1000)
+
+    def _revalidate_cache(self, quiet=False):
+        # Searches keep using the current caches, the services swap in the new ones when loaded
+        if self.cache_worker is not None and self.cache_worker.isRunning():
+            return
+
+        # Without an assets sheet only the notes are refreshed, a failing one waits for its own retry
+        assets_sheetId = self.settings['assetsSheetId']
+        if self._cache_failures['assets'] and time.monotonic() < self._assets_retry_at:
+            assets_sheetId = None
+
+        self._cache_timer.stop()
+        self._refreshing = {'notes', 'assets'} if assets_sheetId else {'notes'}
+        self._failed_services = set()
+        self.cache_worker = GoogleServiceWorker(self.settings['sheetId'], "refresh_cache", assets_sheetId=assets_sheetId)
+        if not quiet:
+            self.cache_worker.log.connect(self._logger)
+        self.cache_worker.failed.connect(lambda error: self._revalidate_failed('notes', error))
+        self.cache_worker.refreshFailed.connect(self._revalidate_failed)
+        self.cache_worker.finished.connect(self._schedule_revalidation)
+        self.cache_worker.start()
+
+    def _revalidate_failed(self, service, error):
+        self._failed_services.add(service)
+        self._logger(f"Refreshing the {service} cache failed, retrying later: " + error[:40])
+
+    def _schedule_revalidation(self):
+        for service in self._refreshing:
+            self._cache_failures[service] = self._cache_failures[service] + 1 if service in self._failed_services else 0
+        if self._cache_failures['assets']:
+            self._assets_retry_at = time.monotonic() + self._refresh_interval('assets') / 1000
+
+        if not self._cache_failures['notes']:
+            self._reset_live_search()
+            self._index_documents()
+        self._cache_timer.start(self._refresh_interval('notes'))
+
+    def _index_documents(self):
+        # Fetches the bodies of new and changed linked documents for full text search
+        if self.index_worker is not None and self.index_worker.isRunning():
+            return
+
+        self.index_worker = GoogleServiceWorker(self.settings['sheetId'], "index_documents", assets_sheetId=self.settings['assetsSheetId'])
+        self.index_worker.log.connect(self._logger)
+        self.index_worker.finished.connect(self._reset_live_search)
+        self.index_worker.start()
 
     def _handle_add_record(self):
         sheet = self._view.get_topic_text()
@@ -153,6 +306,7 @@ class SheetsController():
         status = record.exec_()
         if status:
             data = record.get_data()
+            self._reset_live_search()
             self.worker = GoogleServiceWorker(self.settings['sheetId'], "create_doc", data)
             self.worker.log.connect(self._logger)
             self.worker.recordsDone.connect(self._add_rows)
@@ -160,6 +314,13 @@ class SheetsController():
             self.worker.start()
 
     def copy_code(self, url):
+        # Kept up to date by the prefetch and the document indexer
+        code = NotesService.stored_document_text(url)
+        if code:
+            self._view.copy_to_clipboard(code)
+            self._logger("Code copied successfully")
+            return
+
         self._view.start_spinner()
         self.worker = GoogleServiceWorker(self.settings['sheetId'], "get_copy", url)
         self.worker.log.connect(self._logger)
@@ -172,11 +333,9 @@ class SheetsController():
         self._view.stop_spinner()
 
     def refresh_cache(self):
-        self._view.start_spinner()
-        self.worker = GoogleServiceWorker(self.settings['sheetId'], "refresh_cache", assets_sheetId=self.settings['assetsSheetId'])
-        self.worker.log.connect(self._logger)
-        self.worker.recordsDone.connect(self.refresh_done)
-        self.worker.start()
+        # Asked for by the user, retry a failing assets sheet right away
+        self._assets_retry_at = 0
+        self._revalidate_cache()
     
     def refresh_done(self, def_list = []):
         self._view.stop_spinner()
@@ -276,6 +435,7 @@ class SheetsController():
 
     def _connectSignals(self):
         self._view.search_button.clicked.connect(self._handle_search)
+        self._view.search_line_input.textEdited.connect(lambda text: self._live_timer.start())
         #self._view.add_record.clicked.connect(self._handle_add_record)
         self._view.settings_button.clicked.connect(self._open_settings_dialog)
         self._settings_view.okButton.clicked.connect(self._update_settings)
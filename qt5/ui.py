@@ -3,6 +3,7 @@ import webbrowser
 import queue
 from pathlib import Path
 from qt5.workers import AssetThumbnailWorker
+from search import facet_counts
 from qt5.spin import QtWaitingSpinner
 from qt5.snipper.SnippingMenu import Menu
 from PyQt5 import QtGui, uic
@@ -265,6 +266,8 @@ class AssetResults(QDialog):
         q = queue.Queue()
 
         layout = self.results_layout.layout()
+        self.facets = facet_counts(assets)
+        self.setWindowTitle(self.facets_summary(len(assets)))
 
         for k, _data in enumerate(assets):
             name = _data[2]
@@ -286,6 +289,14 @@ class AssetResults(QDialog):
             self.threads.append(thread)
 
 
+    def facets_summary(self, total):
+        # Shown in the query syntax so the counts double as filter hints
+        parts = [f'Assets ({total})']
+        for facet in ('type', 'ue'):
+            for value, count in self.facets[facet].most_common(5):
+                parts.append(f'{facet}:{value} ({count})')
+        return '   '.join(parts)
+
     def updateThumbnail(self, _data):
         index, data = _data
         image = QtGui.QImage()
@@ -1,6 +1,8 @@
 from PyQt5.QtCore import QThread, pyqtSignal
 from googleapiclient import errors
+import google.auth.exceptions
 from gsuite import NotesService, UnrealService
+from search import SearchInterrupted
 from config import ICONS_CACHE, ASSETS_CACHE
 import socket
 import tempfile
@@ -15,6 +17,10 @@ import queue
 import webbrowser
 import httplib2
 
+# Errors of a service that can not be reached or read, see GoogleServiceWorker.run
+REFRESH_ERRORS = (errors.Error, socket.error, httplib2.ServerNotFoundError,
+        google.auth.exceptions.TransportError, google.auth.exceptions.RefreshError)
+
 
 class ScanProjectsWorker(QThread):
         exclude = [
@@ -75,13 +81,14 @@ class AssetThumbnailWorker(QThread):
             self.queue = queue
 
         def run(self):
+            # Services share their clients, one per worker is enough
+            unreal = UnrealService(None)
             while not self.queue.empty():
                 try:
                     index, _id = self.queue.get(block=False)
                     filename = os.path.join(ICONS_CACHE, _id)
 
                     if not os.path.isfile(filename):
-                        unreal = UnrealService(None)
                         unreal.drive_download_file_cache(_id, ICONS_CACHE)
                     self.resultReady.emit((index, open(filename, 'br').read()))
 
@@ -138,6 +145,9 @@ class AssetsDownloaderWorker(QThread):
 class GoogleServiceWorker(QThread):
 
         log = pyqtSignal(str)
+        failed = pyqtSignal(str)
+        # Service name and error of a failed refresh_cache
+        refreshFailed = pyqtSignal(str, str)
         recordsDone = pyqtSignal(list)
         codeDone = pyqtSignal(str)
 
@@ -147,7 +157,13 @@ class GoogleServiceWorker(QThread):
             self.args = args
             self.assets_sheetId = assets_sheetId
             self.sheetId = sheetId
-            self.notes_service = NotesService(sheetId)
+
+        def search_summary(self, service, result):
+            summary = "Query: '{}'      Found {} results.".format(self.args[0], len(result))
+            # The query could not be run as a regex, say how it was matched
+            if service.notice:
+                summary += "      " + service.notice
+            return summary
 
         def run(self):
             try:
@@ -156,11 +172,12 @@ class GoogleServiceWorker(QThread):
 
                 if self.command == "search_assets":
                     result = unreal.search(*self.args)
-                    self.log.emit("Query: '{}'      Found {} results.".format(self.args[0], len(result)))
+                    self.log.emit(self.search_summary(unreal, result))
                     self.recordsDone.emit(result)
                 elif self.command == "login":
                     notes.authenticate()
-                    unreal.authenticate()
+                    if self.assets_sheetId:
+                        unreal.authenticate()
                     self.log.emit("Successful Login")
                     self.recordsDone.emit([])
                 elif self.command == "get_sheets":
@@ -168,8 +185,17 @@ class GoogleServiceWorker(QThread):
                     self.log.emit("Retrived {} sheets successfully".format(len(sheets)))
                     self.recordsDone.emit(sheets)
                 elif self.command == "search":
-                    result = notes.search(*self.args)
-                    self.log.emit("Query: '{}'      Found {} results.".format(self.args[0], len(result)))
+                    try:
+                        result = notes.search(*self.args, interrupted=self.isInterruptionRequested)
+                    except SearchInterrupted:
+                        # A newer live search superseded this one
+                        return
+                    if self.isInterruptionRequested():
+                        return
+                    summary = self.search_summary(notes, result)
+                    if notes.cache_hit is not None:
+                        summary += "      " + NotesService.results.stats()
+                    self.log.emit(summary)
                     self.recordsDone.emit(result)
                 elif self.command == "upload_asset":
                     data, settings = self.args
@@ -232,11 +258,31 @@ class GoogleServiceWorker(QThread):
                     self.recordsDone.emit([[data['sheet']] + row])
                 elif self.command == "open_sheet":
                     webbrowser.open("https://docs.notes.com/spreadsheets/d/" + self.sheetId + "/edit", new=2)
+                elif self.command == "prefetch_documents":
+                    notes.prefetch_documents(self.args, self.isInterruptionRequested)
+                    self.recordsDone.emit([])
+                elif self.command == "index_documents":
+                    fetched = notes.index_documents(self.isInterruptionRequested)
+                    if fetched:
+                        self.log.emit("Indexed {} documents".format(fetched))
+                    self.recordsDone.emit([])
                 elif self.command == "refresh_cache":
                     self.log.emit("Updating Cache!")
-                    notes.get_cache()
-                    unreal.get_cache()
-                    self.log.emit("Cache updated successfully!")
+                    # Services fail on their own, a broken assets sheet must not hold back the notes
+                    services = [('notes', notes)]
+                    if self.assets_sheetId:
+                        services.append(('assets', unreal))
+                    changed = False
+                    for name, service in services:
+                        try:
+                            changed = service.refresh_cache() or changed
+                        except REFRESH_ERRORS as e:
+                            print(e)
+                            self.refreshFailed.emit(name, str(e))
+                    if changed:
+                        self.log.emit("Cache updated successfully!")
+                    else:
+                        self.log.emit("Cache is up to date")
                     self.recordsDone.emit([])
                 else:
                     self.log.emit("Wrong command passed to GoogleServiceWorker")
@@ -245,8 +291,16 @@ class GoogleServiceWorker(QThread):
             except errors.HttpError as e:
                     print(e)
                     self.log.emit("Http error: Most likely sheetID is invalid.  " + str(e)[:40]+ '...')
+                    self.failed.emit(str(e))
                     self.recordsDone.emit([])
 
             except (errors.Error, socket.error, httplib2.ServerNotFoundError) as e:
                     self.log.emit(str(e))
+                    self.failed.emit(str(e))
+                    self.recordsDone.emit([])
+
+            # Expired token while offline, or a refresh token that was revoked
+            except (google.auth.exceptions.TransportError, google.auth.exceptions.RefreshError) as e:
+                    self.log.emit("Could not refresh the Google login: " + str(e)[:40] + '...')
+                    self.failed.emit(str(e))
                     self.recordsDone.emit([])
@@ -0,0 +1,388 @@
+"""Linear time matching for the regex subset users type into the search box.
+
+Patterns are compiled to a Thompson NFA and searched by lazily building
+the equivalent DFA, so matching never backtracks: every character of the
+text is looked at once. Backreferences, lookarounds and possessive
+quantifiers are not supported, `parse` raises Unsupported for them.
+`compile` raises it for patterns whose program would be too large.
+"""
+import re
+import threading
+
+# Largest {m,n} repetition that is expanded into the program
+MAX_REPEAT = 100
+# Largest program, nested repetitions multiply their counts
+MAX_PROGRAM = 10000
+# Number of DFA states kept per pattern before its caches are dropped
+MAX_STATES = 10000
+
+CHAR, SPLIT, JMP, ASSERT, MATCH = range(5)
+MATCHED = -1
+
+
+class Unsupported(ValueError):
+	pass
+
+
+def is_word(ch):
+	return ch.isalnum() or ch == '_'
+
+
+CLASS_ESCAPES = {
+	'd': lambda ch: ch.isdecimal(),
+	'D': lambda ch: not ch.isdecimal(),
+	'w': is_word,
+	'W': lambda ch: not is_word(ch),
+	's': lambda ch: ch.isspace(),
+	'S': lambda ch: not ch.isspace(),
+}
+CHAR_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'f': '\f', 'v': '\v', 'a': '\a'}
+ASSERT_ESCAPES = {'b': 'word', 'B': 'not_word', 'A': 'start', 'Z': 'end'}
+
+
+def literal(c):
+	low = c.lower()
+	return lambda ch: ch.lower() == low
+
+
+class Parser:
+	"""Recursive descent parser producing a small AST of tuples.
+
+	Nodes are ('char', predicate), ('assert', kind), ('cat', [nodes]),
+	('alt', [nodes]) and ('repeat', node, min, max) with max None for
+	unbounded repetitions.
+	"""
+
+	def __init__(self, pattern):
+		self.pattern = pattern
+		self.pos = 0
+
+	def peek(self):
+		return self.pattern[self.pos] if self.pos < len(self.pattern) else None
+
+	def next(self):
+		c = self.peek()
+		if c is None:
+			raise Unsupported('Unexpected end of pattern')
+		self.pos += 1
+		return c
+
+	def parse(self):
+		if self.pattern.startswith('(?i)'):
+			self.pos = 4
+		node = self.alternation()
+		if self.pos != len(self.pattern):
+			raise Unsupported(f'Unexpected {self.peek()!r} at {self.pos}')
+		return node
+
+	def alternation(self):
+		branches = [self.sequence()]
+		while self.peek() == '|':
+			self.pos += 1
+			branches.append(self.sequence())
+		return branches[0] if len(branches) == 1 else ('alt', branches)
+
+	def sequence(self):
+		items = []
+		while self.peek() not in (None, '|', ')'):
+			items.append(self.quantified())
+		return ('cat', items)
+
+	def quantified(self):
+		atom = self.atom()
+		while True:
+			c = self.peek()
+			if c == '*':
+				bounds = 0, None
+			elif c == '+':
+				bounds = 1, None
+			elif c == '?':
+				bounds = 0, 1
+			elif c == '{':
+				bounds = self.braces()
+				if bounds is None:
+					return atom
+			else:
+				return atom
+
+			if c != '{':
+				self.pos += 1
+			if atom[0] == 'assert':
+				raise Unsupported('Quantified assertion')
+			# Laziness does not change whether a pattern matches
+			if self.peek() == '?':
+				self.pos += 1
+			elif self.peek() == '+':
+				raise Unsupported('Possessive quantifier')
+			atom = ('repeat', atom, *bounds)
+
+	def braces(self):
+		match = re.compile(r'\{(\d*)(?:(,)(\d*))?\}').match(self.pattern, self.pos)
+		if not match or (not match.group(1) and not match.group(2)):
+			# Not a repetition, re treats the brace as a literal
+			return None
+
+		low = int(match.group(1) or 0)
+		high = low if not match.group(2) else (int(match.group(3)) if match.group(3) else None)
+		if max(low, high or 0) > MAX_REPEAT:
+			raise Unsupported('Repetition too large')
+		self.pos = match.end()
+		return low, high
+
+	def atom(self):
+		c = self.next()
+
+		if c == '(':
+			if self.pattern.startswith('?:', self.pos):
+				self.pos += 2
+			elif self.pattern.startswith('?P<', self.pos):
+				self.pos = self.pattern.index('>', self.pos) + 1
+			elif self.peek() == '?':
+				raise Unsupported('Group extension')
+			node = self.alternation()
+			if self.next() != ')':
+				raise Unsupported('Unbalanced parenthesis')
+			return node
+		if c == '[':
+			return self.char_class()
+		if c == '.':
+			return ('char', lambda ch: ch != '\n')
+		if c == '^':
+			return ('assert', 'start')
+		if c == '$':
+			return ('assert', 'line_end')
+		if c == '\\':
+			return self.escape()
+		if c in '*+?)':
+			raise Unsupported(f'Unexpected {c!r}')
+		return ('char', literal(c))
+
+	def escape_char(self):
+		c = self.next()
+		if c in CHAR_ESCAPES:
+			return CHAR_ESCAPES[c]
+		if c in 'xu':
+			size = 2 if c == 'x' else 4
+			code = self.pattern[self.pos:self.pos + size]
+			self.pos += size
+			return chr(int(code, 16))
+		if c.isalnum():
+			raise Unsupported(f'Escape \\{c}')
+		return c
+
+	def escape(self):
+		c = self.peek()
+		if c in CLASS_ESCAPES:
+			self.pos += 1
+			return ('char', CLASS_ESCAPES[c])
+		if c in ASSERT_ESCAPES:
+			self.pos += 1
+			return ('assert', ASSERT_ESCAPES[c])
+		return ('char', literal(self.escape_char()))
+
+	def char_class(self):
+		negate = self.peek() == '^'
+		if negate:
+			self.pos += 1
+
+		items = []
+		first = True
+		while True:
+			c = self.next()
+			if c == ']' and not first:
+				break
+			first = False
+
+			if c == '\\':
+				if self.peek() in CLASS_ESCAPES:
+					items.append(CLASS_ESCAPES[self.next()])
+					continue
+				c = self.escape_char()
+
+			if self.peek() == '-' and self.pattern[self.pos + 1:self.pos + 2] not in ('', ']'):
+				self.pos += 1
+				end = self.next()
+				if end == '\\':
+					end = self.escape_char()
+				items.append(lambda ch, low=c, high=end: low <= ch <= high)
+			else:
+				items.append(lambda ch, c=c: ch == c)
+
+		def predicate(ch):
+			for variant in {ch, ch.lower(), ch.upper()}:
+				if any(item(variant) for item in items):
+					return not negate
+			return negate
+		return ('char', predicate)
+
+
+def emit(node, program):
+	# Every call adds a few instructions at most before the next one checks
+	if len(program) > MAX_PROGRAM:
+		raise Unsupported('Pattern too large')
+	kind = node[0]
+
+	if kind == 'char':
+		program.append((CHAR, node[1]))
+	elif kind == 'assert':
+		program.append((ASSERT, node[1]))
+	elif kind == 'cat':
+		for item in node[1]:
+			emit(item, program)
+	elif kind == 'alt':
+		jumps = []
+		for branch in node[1][:-1]:
+			split = len(program)
+			program.append(None)
+			emit(branch, program)
+			jumps.append(len(program))
+			program.append(None)
+			program[split] = (SPLIT, split + 1, len(program))
+		emit(node[1][-1], program)
+		for jump in jumps:
+			program[jump] = (JMP, len(program))
+	else:
+		_, child, low, high = node
+		for _ in range(low):
+			emit(child, program)
+
+		if high is None:
+			split = len(program)
+			program.append(None)
+			emit(child, program)
+			program.append((JMP, split))
+			program[split] = (SPLIT, split + 1, len(program))
+		else:
+			splits = []
+			for _ in range(high - low):
+				splits.append(len(program))
+				program.append(None)
+				emit(child, program)
+			for split in splits:
+				program[split] = (SPLIT, split + 1, len(program))
+
+
+class LinearPattern:
+	"""Case insensitive pattern with a re.Pattern like `search`.
+
+	DFA states are numbered as they are discovered, a state is the set of
+	NFA threads plus whether the previous character was a word character.
+	Transitions between states are cached per character for the positions
+	that are neither the first nor the last of a text, the others depend on
+	anchors and are resolved through the closure cache.
+	"""
+
+	def __init__(self, node):
+		self.program = []
+		emit(node, self.program)
+		self.program.append((MATCH,))
+		self.start = frozenset([0])
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		self.closures = {}
+		self.ids = {}
+		self.states = []
+		self.table = []
+		self.initial = self.state(self.start, False)
+
+	def state(self, threads, previous_word):
+		key = threads, previous_word
+		state = self.ids.get(key)
+		if state is None:
+			state = self.ids[key] = len(self.states)
+			self.states.append(key)
+			self.table.append({})
+		return state
+
+	def check(self, kind, context):
+		at_start, at_end, before_newline_end, previous_word, next_word = context
+		if kind == 'start':
+			return at_start
+		if kind == 'end':
+			return at_end
+		if kind == 'line_end':
+			return at_end or before_newline_end
+		if kind == 'word':
+			return previous_word != next_word
+		# Like re, \B never matches in an empty text
+		return previous_word == next_word and not (at_start and at_end)
+
+	def closure(self, threads, context):
+		"""Returns the CHAR instructions reachable from `threads` and whether MATCH is."""
+		key = threads, context
+		cached = self.closures.get(key)
+		if cached is not None:
+			return cached
+
+		program = self.program
+		seen = set()
+		stack = list(threads)
+		reached = []
+		matched = False
+
+		while stack:
+			pc = stack.pop()
+			if pc in seen:
+				continue
+			seen.add(pc)
+			op = program[pc]
+
+			if op[0] == CHAR:
+				reached.append(pc)
+			elif op[0] == SPLIT:
+				stack.extend((op[2], op[1]))
+			elif op[0] == JMP:
+				stack.append(op[1])
+			elif op[0] == ASSERT:
+				if self.check(op[1], context):
+					stack.append(pc + 1)
+			else:
+				matched = True
+
+		result = self.closures[key] = frozenset(reached), matched
+		return result
+
+	def move(self, state, ch, context):
+		"""Returns the state after `ch` or MATCHED when a match ends before it."""
+		threads, matched = self.closure(self.states[state][0], context)
+		if matched:
+			return MATCHED
+
+		threads = frozenset([pc + 1 for pc in threads if self.program[pc][1](ch)]) | self.start
+		return self.state(threads, context[4])
+
+	def search(self, text):
+		with self.lock:
+			if len(self.states) > MAX_STATES:
+				self.reset()
+
+			table = self.table
+			state = self.initial
+			last = len(text) - 1
+
+			for pos, ch in enumerate(text):
+				if 0 < pos < last:
+					next_state = table[state].get(ch)
+					if next_state is None:
+						context = (False, False, False, self.states[state][1], is_word(ch))
+						next_state = table[state][ch] = self.move(state, ch, context)
+				else:
+					context = (pos == 0, False, pos == last and ch == '\n', self.states[state][1], is_word(ch))
+					next_state = self.move(state, ch, context)
+
+				if next_state == MATCHED:
+					return True
+				state = next_state
+
+			threads, previous_word = self.states[state]
+			return self.closure(threads, (not text, True, False, previous_word, False))[1]
+
+
+def parse(pattern):
+	return Parser(pattern).parse()
+
+
+def compile(node):
+	return LinearPattern(node)
@@ -0,0 +1,590 @@
+import re
+import time
+import math
+import heapq
+import unicodedata
+import functools
+import threading
+from array import array
+from collections import defaultdict, Counter, OrderedDict
+import saferegex
+from config import FUZZY_PREFIX
+
+TOKEN_RE = re.compile(r'\w+')
+REGEX_META = frozenset('.^$*+?{}[]\\|()')
+FACET_RE = re.compile(r'(?:^|\s)(tag|ue|type):(\S+)', re.IGNORECASE)
+TAG_SPLIT_RE = re.compile(r'[,;\s]+')
+
+
+def normalize(text):
+	"""Casefolded, NFKC normalized `text` with accents stripped.
+
+	Search keys of the cached rows and literal queries are compared in
+	this form.
+	"""
+	if text.isascii():
+		return text.lower()
+
+	text = unicodedata.normalize('NFKD', text)
+	text = ''.join(c for c in text if not unicodedata.combining(c))
+	return unicodedata.normalize('NFKC', text.casefold())
+
+
+def is_literal(query):
+	return not any(c in REGEX_META for c in query)
+
+
+class QueryPlan:
+	"""Cheapest matcher for a search query.
+
+	Plain literals become substring checks and `^literal` (optionally
+	followed by `.*`) a startswith check, both on normalized text.
+	Everything else is compiled once as a case insensitive saferegex
+	pattern and matched against the raw text, in time linear in its
+	length. Patterns saferegex can not run, e.g. with backreferences, are
+	searched for literally and `notice` says so.
+	"""
+	LITERAL = 'literal'
+	PREFIX = 'prefix'
+	REGEX = 'regex'
+
+	def __init__(self, query, literal=False):
+		self.query = query
+		self.pattern = None
+		self.notice = None
+
+		if literal or is_literal(query):
+			self.kind, self.text = QueryPlan.LITERAL, normalize(query)
+			return
+
+		prefix = query[1:-2] if query.endswith('.*') else query[1:]
+		if query.startswith('^') and is_literal(prefix):
+			self.kind, self.text = QueryPlan.PREFIX, normalize(prefix)
+			return
+
+		try:
+			re.compile(query)
+		except re.error:
+			# Not a usable pattern, search for it as typed
+			self.kind, self.text = QueryPlan.LITERAL, normalize(query)
+			return
+
+		try:
+			self.pattern = saferegex.compile(saferegex.parse(query))
+			self.kind, self.text = QueryPlan.REGEX, None
+		except saferegex.Unsupported as e:
+			# A single re.search call of such a pattern can run for minutes
+			self.kind, self.text = QueryPlan.LITERAL, normalize(query)
+			self.notice = f"Pattern '{query}' is not supported ({e}), searched for it literally"
+
+	def match(self, value, key=None):
+		"""Matches a cell value, `key` is normalize(value) when it was precomputed."""
+		if self.kind == QueryPlan.REGEX:
+			return self.pattern.search(value)
+
+		key = normalize(value) if key is None else key
+		if self.kind == QueryPlan.LITERAL:
+			return self.text in key
+		return key.startswith(self.text)
+
+	@property
+	def terms(self):
+		"""Words of a literal or prefix query, the terms its results are ranked by."""
+		return TOKEN_RE.findall(self.text) if self.text else []
+
+	def degrade(self):
+		"""Literal plan for the query, for regex searches over their time budget."""
+		plan = QueryPlan(self.query, literal=True)
+		plan.notice = f"Pattern '{self.query}' took too long, searched for it literally"
+		return plan
+
+
+class SearchTimeout(Exception):
+	pass
+
+
+class SearchInterrupted(Exception):
+	"""Raised when the caller gave up on a search, nothing is returned or cached."""
+
+
+def within_budget(rows, deadline, interrupted=None):
+	"""Yields `rows`, raising SearchTimeout once time.monotonic() passes `deadline`.
+
+	Either check is skipped when None. Raises SearchInterrupted once
+	`interrupted` returns True.
+	"""
+	for i, row in enumerate(rows):
+		if not i & 0xff:
+			if deadline is not None and time.monotonic() > deadline:
+				raise SearchTimeout()
+			if interrupted is not None and interrupted():
+				raise SearchInterrupted()
+		yield row
+
+
+@functools.lru_cache(maxsize=256)
+def plan_query(query):
+	return QueryPlan(query)
+
+
+def result_key(query, sheets):
+	"""Key under which the results of `query` over `sheets` are cached."""
+	sheets = frozenset(normalize(_) for _ in sheets)
+	if query.startswith(FUZZY_PREFIX):
+		return FUZZY_PREFIX, normalize(query[len(FUZZY_PREFIX):]), sheets
+
+	plan = plan_query(query)
+	return plan.kind, plan.text if plan.kind != QueryPlan.REGEX else query, sheets
+
+
+class ResultCache:
+	"""Bounded LRU cache of search results for one snapshot generation.
+
+	Results are kept with the notice of the search that found them, see
+	QueryPlan.notice. Entries of older generations can never be returned,
+	the cache is emptied as soon as a lookup comes in for a newer
+	generation.
+	"""
+
+	def __init__(self, maxsize):
+		self.maxsize = maxsize
+		self.entries = OrderedDict()
+		self.generation = None
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+
+	def get(self, generation, key):
+		with self.lock:
+			if generation != self.generation:
+				self.entries.clear()
+				self.generation = generation
+
+			entry = self.entries.get(key)
+			if entry is None:
+				self.misses += 1
+				return None
+
+			self.hits += 1
+			self.entries.move_to_end(key)
+			result, notice = entry
+			return list(result), notice
+
+	def put(self, generation, key, result, notice=None):
+		with self.lock:
+			if generation != self.generation:
+				return
+
+			self.entries[key] = list(result), notice
+			self.entries.move_to_end(key)
+			if len(self.entries) > self.maxsize:
+				self.entries.popitem(last=False)
+
+	def stats(self):
+		return f"Search result cache: {self.hits} hits, {self.misses} misses, {len(self.entries)} entries"
+
+
+def refines(previous, query):
+	"""True when every row matching `query` also matches `previous`.
+
+	The rows found for `previous` can then be searched instead of the
+	whole cache.
+	"""
+	if not previous or previous.startswith(FUZZY_PREFIX) or query.startswith(FUZZY_PREFIX):
+		return False
+
+	previous, query = plan_query(previous), plan_query(query)
+
+	if previous.kind == QueryPlan.LITERAL and query.kind != QueryPlan.REGEX:
+		return previous.text in query.text
+	if previous.kind == QueryPlan.PREFIX and query.kind == QueryPlan.PREFIX:
+		return query.text.startswith(previous.text)
+	return False
+
+
+def rank_fields(rows, plan, fields):
+	"""Matches `plan` against several columns of `rows` in a single pass.
+
+	Args:
+		rows: the cached sheet records.
+		plan: a QueryPlan.
+		fields: (attribute, score) pairs. A row is scored by the best
+			attribute it matches, `<attribute>_key` holds its search key.
+
+	Results are ordered by score and then by row order. A row that did
+	not match the best scoring column is dropped when an equal row was
+	already returned.
+	"""
+	fields = sorted(fields, key=lambda field: -field[1])
+	buckets = [[] for _ in fields]
+
+	for row in rows:
+		for bucket, (name, score) in zip(buckets, fields):
+			if plan.match(getattr(row, name), getattr(row, name + '_key')):
+				bucket.append(row)
+				break
+
+	result = list(buckets[0]) if buckets else []
+	seen = {tuple(row) for row in result}
+
+	for bucket in buckets[1:]:
+		for row in bucket:
+			key = tuple(row)
+			if key not in seen:
+				seen.add(key)
+				result.append(row)
+
+	return result
+
+
+def trigrams(text):
+	return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def row_posting():
+	# Row ids as 4 byte machine ints, pickled as one bytes object
+	return array('I')
+
+
+def extend_posting(postings, key, value, shared):
+	if shared and key in postings:
+		postings[key] = postings[key][:]
+	postings[key].append(value)
+
+
+class TextIndex:
+	"""Inverted index over one text column of a sheet cache.
+
+	Row ids are positions in the cache list. Rows are added in cache order,
+	so every posting is already sorted. Postings are row_posting arrays.
+	Texts and literals are expected in their normalize() form.
+	"""
+
+	def __init__(self, texts=()):
+		self.tokens = defaultdict(row_posting)
+		self.grams = defaultdict(row_posting)
+		self.size = 0
+		self.shared = False
+
+		for text in texts:
+			self.add(text)
+
+	def copy(self):
+		"""Returns a copy that shares the postings with this index.
+
+		Rows added to the copy replace the postings they touch instead
+		of extending them, so this index is never modified.
+		"""
+		index = TextIndex()
+		index.tokens = defaultdict(row_posting, self.tokens)
+		index.grams = defaultdict(row_posting, self.grams)
+		index.size = self.size
+		index.shared = True
+		return index
+
+	def add(self, text):
+		"""Indexes the next row and returns the tokens new to the vocabulary."""
+		row_id = self.size
+		self.size += 1
+		new_tokens = []
+
+		for token in set(TOKEN_RE.findall(text)):
+			if token not in self.tokens:
+				new_tokens.append(token)
+			extend_posting(self.tokens, token, row_id, self.shared)
+
+		for gram in trigrams(text):
+			extend_posting(self.grams, gram, row_id, self.shared)
+
+		return new_tokens
+
+	def candidates(self, literal):
+		"""Returns the sorted ids of rows that may contain `literal`.
+
+		Returns None when the index can not narrow the search down and the
+		caller has to scan every row.
+		"""
+		if len(literal) >= 3:
+			postings = [self.grams.get(gram) for gram in trigrams(literal)]
+			if not all(postings):
+				return []
+			postings.sort(key=len)
+			return sorted(set(postings[0]).intersection(*postings[1:]))
+
+		# Short words can only occur inside a single token, so the
+		# vocabulary is scanned instead of the rows.
+		if literal and TOKEN_RE.fullmatch(literal):
+			ids = set()
+			for token, posting in self.tokens.items():
+				if literal in token:
+					ids.update(posting)
+			return sorted(ids)
+
+		return None
+
+
+def normalize_version(version):
+	return re.sub(r'^ue\s*', '', normalize(version.strip()))
+
+
+def row_facets(row):
+	"""Yields the (facet, value) pairs of an assets sheet row."""
+	if len(row) > 0 and row[0].strip():
+		yield 'type', normalize(row[0].strip())
+	if len(row) > 1 and row[1].strip():
+		yield 'ue', normalize_version(row[1])
+	if len(row) > 3:
+		for tag in set(TAG_SPLIT_RE.split(normalize(row[3]))):
+			if tag:
+				yield 'tag', tag
+
+
+def parse_facets(query):
+	"""Splits `tag:`, `ue:` and `type:` filters out of a query.
+
+	Returns the list of (facet, value) filters and the remaining free text.
+	"""
+	filters = []
+	for facet, value in FACET_RE.findall(query):
+		facet = facet.lower()
+		value = normalize_version(value) if facet == 'ue' else normalize(value)
+		filters.append((facet, value))
+	return filters, FACET_RE.sub(' ', query).strip()
+
+
+def facet_counts(rows):
+	counts = {'type': Counter(), 'ue': Counter(), 'tag': Counter()}
+	for row in rows:
+		for facet, value in row_facets(row):
+			counts[facet][value] += 1
+	return counts
+
+
+class FacetIndex:
+	"""Row ids of the assets sheet keyed by facet and value."""
+
+	def __init__(self, rows=()):
+		self.values = {'type': defaultdict(set), 'ue': defaultdict(set), 'tag': defaultdict(set)}
+		self.size = 0
+		self.shared = False
+
+		for row in rows:
+			self.add(row)
+
+	def copy(self):
+		"""Returns a copy that shares the posting sets with this index, see TextIndex.copy."""
+		index = FacetIndex()
+		index.values = {facet: defaultdict(set, values) for facet, values in self.values.items()}
+		index.size = self.size
+		index.shared = True
+		return index
+
+	def add(self, row):
+		row_id = self.size
+		self.size += 1
+
+		for facet, value in row_facets(row):
+			values = self.values[facet]
+			if self.shared:
+				values[value] = values.get(value, set()) | {row_id}
+			else:
+				values[value].add(row_id)
+
+	def select(self, filters):
+		"""Returns the sorted ids of rows matching every filter."""
+		postings = [self.values[facet].get(value, set()) for facet, value in filters]
+		postings.sort(key=len)
+		return sorted(postings[0].intersection(*postings[1:])) if postings else []
+
+
+class BM25Index:
+	"""Term statistics of the notes sheets for BM25 ranking.
+
+	Every field is scored as its own document and the field scores are
+	summed with the field weights. Only the document frequencies and total
+	field lengths are kept, term frequencies are counted on the rows being
+	ranked.
+	"""
+	FIELDS = (('title', 2.0), ('category', 1.0))
+	K1 = 1.2
+	B = 0.75
+
+	def __init__(self, rows=()):
+		self.size = 0
+		self.frequencies = {name: Counter() for name, _ in self.FIELDS}
+		self.lengths = {name: 0 for name, _ in self.FIELDS}
+
+		for row in rows:
+			self.add(row)
+
+	def copy(self):
+		"""Returns a copy that can be added to without modifying this index."""
+		index = BM25Index()
+		index.size = self.size
+		index.frequencies = {name: Counter(counts) for name, counts in self.frequencies.items()}
+		index.lengths = dict(self.lengths)
+		return index
+
+	def add(self, row):
+		self.size += 1
+		for name, _ in self.FIELDS:
+			tokens = TOKEN_RE.findall(getattr(row, name + '_key'))
+			self.frequencies[name].update(set(tokens))
+			self.lengths[name] += len(tokens)
+
+	def weights(self, terms):
+		"""Returns per field the (term, field weight * idf) pairs and the BM25 length factors."""
+		fields = []
+		for name, weight in self.FIELDS:
+			idfs = []
+			for term in set(terms):
+				df = self.frequencies[name].get(term, 0)
+				idfs.append((term, weight * math.log(1 + (self.size - df + 0.5) / (df + 0.5))))
+			average = max(self.lengths[name], 1) / max(self.size, 1)
+			fields.append((idfs, self.K1 * (1 - self.B), self.K1 * self.B / average))
+		return fields
+
+	def score(self, fields, keys):
+		"""BM25 score of a row whose search keys are `keys` in FIELDS order, `fields` is from weights()."""
+		score = 0.0
+		for (idfs, constant, per_token), key in zip(fields, keys):
+			if not any(term in key for term, _ in idfs):
+				continue
+
+			tokens = TOKEN_RE.findall(key)
+			norm = constant + per_token * len(tokens)
+			for term, idf in idfs:
+				tf = tokens.count(term)
+				if tf:
+					score += idf * tf * (self.K1 + 1) / (tf + norm)
+		return score
+
+	def rank(self, rows, terms, keys, limit):
+		"""Moves the `limit` rows scoring best for `terms` to the front.
+
+		Args:
+			rows: the matching rows, in sheet order.
+			terms: normalized query words, see QueryPlan.terms.
+			keys: returns the search keys of a row in FIELDS order.
+			limit: number of rows ranked, the others keep their order.
+		"""
+		if not terms or not rows:
+			return rows
+
+		fields = self.weights(terms)
+		scored = []
+		for i, row in enumerate(rows):
+			score = self.score(fields, keys(row))
+			if score > 0:
+				scored.append((score, -i))
+
+		best = heapq.nlargest(limit, scored)
+		top = {-i for _, i in best}
+		return [rows[-i] for _, i in best] + [row for i, row in enumerate(rows) if i not in top]
+
+
+def bounded_distance(a, b, limit):
+	"""Levenshtein distance between `a` and `b`, or None when it exceeds `limit`."""
+	if abs(len(a) - len(b)) > limit:
+		return None
+
+	previous = list(range(len(b) + 1))
+	for i, ca in enumerate(a, 1):
+		current = [i]
+		for j, cb in enumerate(b, 1):
+			current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+		if min(current) > limit:
+			return None
+		previous = current
+
+	return previous[-1] if previous[-1] <= limit else None
+
+
+def padded_bigrams(word):
+	word = f'${word}$'
+	return {word[i:i + 2] for i in range(len(word) - 1)}
+
+
+class FuzzyIndex:
+	"""Typo tolerant lookup over the token vocabulary of a TextIndex.
+
+	Vocabulary words are indexed by their padded bigrams. Every edit
+	removes at most two bigrams of a token, so a word within edit distance
+	k shares all but 2k of them. Only those candidates are verified with
+	the bounded edit distance. Unlike trigrams the bound leaves candidates
+	for tokens of every length but one, a one letter token only matches
+	itself.
+	"""
+
+	def __init__(self, tokens):
+		self.tokens = tokens
+		self.grams = defaultdict(list)
+		self.shared = False
+		self.add_words(tokens)
+
+	def copy(self, tokens):
+		"""Returns a copy over the vocabulary of a copied TextIndex, see TextIndex.copy."""
+		index = FuzzyIndex({})
+		index.tokens = tokens
+		index.grams = defaultdict(list, self.grams)
+		index.shared = True
+		return index
+
+	def add_words(self, words):
+		for word in words:
+			for gram in padded_bigrams(word):
+				extend_posting(self.grams, gram, word, self.shared)
+
+	@staticmethod
+	def max_distance(token):
+		if len(token) <= 1:
+			return 0
+		return 1 if len(token) <= 4 else 2
+
+	def similar(self, token, deadline):
+		"""Returns {word: distance} for vocabulary words close to `token`."""
+		limit = self.max_distance(token)
+		if not limit:
+			return {token: 0} if token in self.tokens else {}
+
+		grams = padded_bigrams(token)
+		required = len(grams) - 2 * limit
+		shared = Counter()
+		for gram in grams:
+			shared.update(self.grams.get(gram, ()))
+		candidates = [word for word, count in shared.items()
+				if count >= required and abs(len(word) - len(token)) <= limit]
+
+		words = {}
+		for word in candidates:
+			if time.monotonic() > deadline:
+				break
+			distance = bounded_distance(token, word, limit)
+			if distance is not None:
+				words[word] = distance
+		return words
+
+	def search(self, query, budget):
+		"""Returns row ids ranked by the summed distance of every query token.
+
+		Rows have to match all tokens of the query. Work stops once `budget`
+		seconds are spent and the matches found so far are ranked.
+		"""
+		deadline = time.monotonic() + budget
+		scores = None
+
+		for token in set(TOKEN_RE.findall(normalize(query))):
+			best = {}
+			for word, distance in self.similar(token, deadline).items():
+				for row_id in self.tokens[word]:
+					if distance < best.get(row_id, distance + 1):
+						best[row_id] = distance
+
+			if scores is None:
+				scores = best
+			else:
+				scores = {row_id: score + best[row_id] for row_id, score in scores.items() if row_id in best}
+
+		if not scores:
+			return []
+		return sorted(scores, key=lambda row_id: (scores[row_id], row_id))
@@ -0,0 +1,219 @@
+import os
+import sys
+import pickle
+import tempfile
+import itertools
+from config import SNAPSHOTS_DIR
+from search import normalize
+
+# Bump when the layout of the pickled caches or indexes changes
+SNAPSHOT_FORMAT = 9
+
+_generations = itertools.count(1)
+
+# Well known URL prefixes and suffixes stripped from cached links, a link
+# starting with chr(i + 1) uses URL_AFFIXES[i]
+URL_AFFIXES = (
+	('https://docs.google.com/document/d/', '/edit'),
+	('https://docs.google.com/document/d/', ''),
+)
+
+
+def compress_url(url):
+	for i, (prefix, suffix) in enumerate(URL_AFFIXES):
+		if url.startswith(prefix) and url.endswith(suffix) and len(url) >= len(prefix) + len(suffix):
+			return chr(i + 1) + url[len(prefix):len(url) - len(suffix)]
+	return url
+
+
+def expand_url(value):
+	if value and ord(value[0]) <= len(URL_AFFIXES):
+		prefix, suffix = URL_AFFIXES[ord(value[0]) - 1]
+		return prefix + value[1:] + suffix
+	return value
+
+
+def search_key(text):
+	# Share the string when normalizing does not change it
+	key = normalize(text)
+	return text if key == text else key
+
+
+def _restore_record(cls, values):
+	record = object.__new__(cls)
+	for name, value in zip(cls.__slots__, values):
+		setattr(record, name, value)
+	return record
+
+
+def pack_rows(rows):
+	"""Returns the record class of `rows` and their slot values, one list per slot.
+
+	The lists pickle without a Python call per record, unpack_rows
+	restores the records.
+	"""
+	if not rows:
+		return None, []
+	cls = type(rows[0])
+	return cls, [[getattr(row, name) for row in rows] for name in cls.__slots__]
+
+
+def unpack_rows(cls, columns):
+	if cls is None:
+		return []
+	rows = [object.__new__(cls) for _ in columns[0]]
+	for name, column in zip(cls.__slots__, columns):
+		list(map(getattr(cls, name).__set__, rows, column))
+	return rows
+
+
+class Record:
+	"""Compact, read only sheet row.
+
+	Records index, iterate and compare like the row lists they replace.
+	`as_list` returns the row list handed to the UI. The `*_key` slots hold
+	the normalize() form of the searched columns, computed once on load
+	and pickled along with the row.
+	"""
+	__slots__ = ()
+	FIELDS = ()
+
+	def __reduce__(self):
+		return _restore_record, (type(self), tuple(getattr(self, name) for name in self.__slots__))
+
+	def __getitem__(self, i):
+		return getattr(self, self.FIELDS[i])
+
+	def __len__(self):
+		return len(self.FIELDS)
+
+	def __iter__(self):
+		return (getattr(self, field) for field in self.FIELDS)
+
+	def __eq__(self, other):
+		return list(self) == list(other)
+
+	def __hash__(self):
+		return hash(tuple(self))
+
+	def as_list(self):
+		return list(self)
+
+
+class NoteRow(Record):
+	__slots__ = ('sheet', 'category', 'title', '_links', 'sheet_key', 'category_key', 'title_key')
+	FIELDS = ('sheet', 'category', 'title', 'link', 'code_link')
+
+	def __init__(self, sheet, category, title, link='', code_link=''):
+		self.sheet = sys.intern(sheet)
+		self.category = sys.intern(category)
+		self.title = title
+		self.sheet_key = sys.intern(normalize(sheet))
+		self.category_key = sys.intern(normalize(category))
+		self.title_key = search_key(title)
+		# Both links share one string object
+		self._links = compress_url(link) + '\0' + compress_url(code_link)
+
+	@property
+	def link(self):
+		return expand_url(self._links.partition('\0')[0])
+
+	@property
+	def code_link(self):
+		return expand_url(self._links.partition('\0')[2])
+
+
+class AssetRow(Record):
+	__slots__ = ('type', 'ue_version', 'name', 'tags', 'thumbnail_id', 'file_id', 'name_key', 'tags_key')
+	FIELDS = ('type', 'ue_version', 'name', 'tags', 'thumbnail_id', 'file_id')
+
+	def __init__(self, type='', ue_version='', name='', tags='', thumbnail_id='', file_id=''):
+		# Appended rows may hold None for an empty cell
+		type, ue_version, name, tags, thumbnail_id, file_id = (
+				'' if value is None else value for value in (type, ue_version, name, tags, thumbnail_id, file_id))
+		self.type = sys.intern(type)
+		self.ue_version = sys.intern(ue_version)
+		self.name = name
+		self.tags = tags
+		self.thumbnail_id = thumbnail_id
+		self.file_id = file_id
+		self.name_key = search_key(name)
+		self.tags_key = search_key(tags)
+
+
+class Snapshot:
+	"""Immutable view of a sheet cache and the structures built on it.
+
+	Readers take the published snapshot once and use only that object for
+	the whole operation. Writers never modify a published snapshot, they
+	build a new one with `replace` and publish it with a single assignment,
+	so the read path needs no locking. Every snapshot gets a new
+	generation number that derived data can be keyed on.
+	"""
+	__slots__ = ('generation', 'rows', 'version', '_parts')
+
+	def __init__(self, rows, version=None, **parts):
+		self.generation = next(_generations)
+		self.rows = rows
+		self.version = version
+		self._parts = parts
+
+	def __getattr__(self, name):
+		if name.startswith('_'):
+			raise AttributeError(name)
+		try:
+			return self._parts[name]
+		except KeyError:
+			raise AttributeError(name) from None
+
+	def replace(self, **changes):
+		parts = {'rows': self.rows, 'version': self.version, **self._parts, **changes}
+		return Snapshot(**parts)
+
+	def state(self):
+		return {'rows': self.rows, 'version': self.version, **self._parts}
+
+
+def snapshot_path(kind, spreadsheet_id):
+	return SNAPSHOTS_DIR / f'{kind}-{spreadsheet_id}.pickle'
+
+
+def save_snapshot(kind, spreadsheet_id, snapshot):
+	"""Atomically writes a Snapshot to disk."""
+	if not spreadsheet_id:
+		return
+
+	fd, tmp = tempfile.mkstemp(dir=SNAPSHOTS_DIR, suffix='.tmp')
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			state = snapshot.state()
+			state['rows'] = pack_rows(state['rows'])
+			pickle.dump((SNAPSHOT_FORMAT, state), f, protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp, snapshot_path(kind, spreadsheet_id))
+	except OSError as e:
+		print(f"Could not save {kind} snapshot: {e}")
+		if os.path.exists(tmp):
+			os.remove(tmp)
+
+
+def load_snapshot(kind, spreadsheet_id):
+	"""Returns the Snapshot stored by save_snapshot, with a new generation.
+
+		Returns None if there is no usable snapshot.
+	"""
+	if not spreadsheet_id:
+		return None
+
+	try:
+		with open(snapshot_path(kind, spreadsheet_id), 'rb') as f:
+			version, state = pickle.load(f)
+	except FileNotFoundError:
+		return None
+	except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError) as e:
+		print(f"Ignoring unreadable {kind} snapshot: {e}")
+		return None
+
+	if version != SNAPSHOT_FORMAT:
+		return None
+	state['rows'] = unpack_rows(*state['rows'])
+	return Snapshot(**state)
@@ -0,0 +1,47 @@
+"""Tests of the stored document texts.
+
+Run from the repository root: python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docstore import DocumentStore
+
+
+class DocumentStoreTest(unittest.TestCase):
+
+	def setUp(self):
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		self.path = Path(directory.name) / 'documents.pickle'
+
+	def test_load_saved(self):
+		store = DocumentStore(self.path)
+		store.loaded = True
+		store.put('a', '1', 'Blueprint Interfaces')
+		store.put('b', '2', 'Material functions')
+		store.save()
+
+		loaded = DocumentStore(self.path)
+		loaded.put('b', '3', 'Material layers')
+		loaded.load()
+		self.assertEqual(loaded.version('a'), '1')
+		self.assertEqual(loaded.search('interfaces'), {'a'})
+		# Kept over the saved version
+		self.assertEqual(loaded.text('b'), 'Material layers')
+		self.assertEqual(loaded.search('functions'), set())
+
+	def test_load_missing(self):
+		store = DocumentStore(self.path)
+		store.load()
+		self.assertTrue(store.loaded)
+		self.assertEqual(store.ids(), set())
+
+
+if __name__ == '__main__':
+	unittest.main()
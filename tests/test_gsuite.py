@@ -0,0 +1,59 @@
+"""Tests of the sheet caches kept by the Google services.
+
+Run from the repository root: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gsuite import NotesService, UnrealService
+from snapshot import Snapshot, NoteRow, AssetRow
+from search import TextIndex, FacetIndex, FuzzyIndex
+
+
+class ApplyAppendTest(unittest.TestCase):
+
+	def setUp(self):
+		for service in (NotesService, UnrealService):
+			patch = mock.patch.object(service, 'snapshot', None)
+			patch.start()
+			self.addCleanup(patch.stop)
+
+	def test_note_without_code(self):
+		rows = [NoteRow('Sheet', 'Category', 'First note', 'https://docs.google.com/document/d/a/edit')]
+		NotesService.snapshot = NotesService._build_snapshot({'Sheet': rows}, '1', {'Sheet': 2})
+		notes = NotesService('sheet')
+
+		row = ['Category', 'Second note', 'https://docs.google.com/document/d/b/edit', None]
+		self.assertTrue(notes.apply_append('Sheet', row, {'updatedRows': 1, 'updatedRange': 'Sheet!A3:D3'}))
+
+		snapshot = NotesService.snapshot
+		self.assertEqual(snapshot.rows[-1].as_list(),
+				['Sheet', 'Category', 'Second note', 'https://docs.google.com/document/d/b/edit', ''])
+		self.assertEqual(snapshot.row_counts, {'Sheet': 3})
+		self.assertEqual(snapshot.index.candidates('second'), [1])
+
+	def test_misaligned_note(self):
+		NotesService.snapshot = NotesService._build_snapshot({'Sheet': []}, '1', {'Sheet': 5})
+		notes = NotesService('sheet')
+		row = ['Category', 'Note', None, None]
+		self.assertFalse(notes.apply_append('Sheet', row, {'updatedRows': 1, 'updatedRange': 'Sheet!A9:D9'}))
+
+	def test_asset_with_empty_cells(self):
+		rows = [AssetRow('Asset', '5.1', 'Rock', 'stone', 'thumb', 'file')]
+		names = TextIndex(row.name_key for row in rows)
+		UnrealService.snapshot = Snapshot(rows, '1', sheet='assets', names=names,
+				facets=FacetIndex(rows), fuzzy=FuzzyIndex(names.tokens))
+		unreal = UnrealService('sheet')
+
+		row = ['Asset', None, 'Tree', 'wood', None, 'file2']
+		self.assertTrue(unreal.apply_append('assets', row, {'updatedRows': 1, 'updatedRange': 'assets!A3:F3'}))
+		self.assertEqual(UnrealService.snapshot.rows[-1].as_list(), ['Asset', '', 'Tree', 'wood', '', 'file2'])
+		self.assertEqual(UnrealService.snapshot.facets.select([('tag', 'wood')]), [1])
+
+
+if __name__ == '__main__':
+	unittest.main()
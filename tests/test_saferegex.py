@@ -0,0 +1,86 @@
+"""Differential check of saferegex against re on random patterns and texts.
+
+Run from the repository root: python -m unittest discover tests
+"""
+import os
+import re
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import saferegex
+
+ALPHABET = 'abAB1 _.-\n'
+ATOMS = ['a', 'b', 'A', '1', ' ', '.', r'\.', r'\d', r'\w', r'\W', r'\s', r'\S',
+		'[ab]', '[^a]', '[a-b1]', r'[\w.]', r'[^\s]', r'\-']
+ASSERTIONS = ['^', '$', r'\b', r'\B', r'\A', r'\Z']
+QUANTIFIERS = ['*', '+', '?', '{2}', '{1,3}', '{,2}', '{2,}', '*?', '+?', '??']
+BOUNDED_QUANTIFIERS = ['?', '{2}', '{1,3}', '{,2}', '??']
+
+
+def random_pattern(rng, depth=0):
+	# Shallow and with bounded group repetitions, re itself backtracks
+	# for seconds on nested unbounded ones
+	items = []
+	for _ in range(rng.randint(1, 3)):
+		roll = rng.random()
+		if roll < 0.1:
+			items.append(rng.choice(ASSERTIONS))
+			continue
+		if roll < 0.3 and depth < 2:
+			group = '(' if rng.random() < 0.5 else '(?:'
+			atom = group + '|'.join(random_pattern(rng, depth + 1) for _ in range(rng.randint(1, 3))) + ')'
+			quantifiers = BOUNDED_QUANTIFIERS
+		else:
+			atom = rng.choice(ATOMS)
+			quantifiers = QUANTIFIERS
+		if rng.random() < 0.4:
+			atom += rng.choice(quantifiers)
+		items.append(atom)
+	return ''.join(items)
+
+
+def random_text(rng):
+	return ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 12)))
+
+
+class DifferentialTest(unittest.TestCase):
+	PATTERNS = 2000
+	TEXTS = 50
+
+	def test_matches_like_re(self):
+		rng = random.Random(16)
+		checked = 0
+		for _ in range(self.PATTERNS):
+			pattern = random_pattern(rng)
+			try:
+				expected = re.compile(pattern, re.IGNORECASE)
+				linear = saferegex.compile(saferegex.parse(pattern))
+			except (re.error, saferegex.Unsupported):
+				continue
+
+			for _ in range(self.TEXTS):
+				text = random_text(rng)
+				self.assertEqual(linear.search(text), expected.search(text) is not None,
+						f'{pattern!r} on {text!r}')
+			checked += 1
+		self.assertGreater(checked, self.PATTERNS // 2)
+
+	def test_backtracking_patterns(self):
+		for pattern, text in [
+				(r'(a+)+$', 'a' * 5000 + '!'),
+				(r'(a|aa)*b', 'a' * 5000),
+				(r'\w*\w*\w*\w*\w*\w*\w*\w*!', 'a' * 5000),
+				(r'(x+x+)+y', 'x' * 5000)]:
+			self.assertFalse(saferegex.compile(saferegex.parse(pattern)).search(text), pattern)
+
+	def test_unsupported(self):
+		for pattern in [r'(a|a)*\1c', r'(?=a)b', r'(?<!a)b', 'a++', 'a{1000}', r'(((a{100}){100}){100}){100}']:
+			with self.assertRaises(saferegex.Unsupported):
+				saferegex.compile(saferegex.parse(pattern))
+
+
+if __name__ == '__main__':
+	unittest.main()
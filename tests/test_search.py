@@ -0,0 +1,43 @@
+"""Tests of the search indexes.
+
+Run from the repository root: python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import FuzzyIndex, TextIndex, bounded_distance
+
+
+class FuzzyIndexTest(unittest.TestCase):
+
+	def setUp(self):
+		rng = random.Random(5)
+		words = {''.join(rng.choice('aeinrst') for _ in range(rng.randint(1, 9))) for _ in range(3000)}
+		self.index = FuzzyIndex(TextIndex(sorted(words)).tokens)
+
+	def test_finds_every_close_word(self):
+		rng = random.Random(6)
+		tokens = ['a', 'aa', 'aaa', 'aaaaa', 'aaaaaa', 'tat', 'stars', 'retina']
+		tokens += [''.join(rng.choice('aeinrstx') for _ in range(rng.randint(1, 10))) for _ in range(300)]
+
+		for token in tokens:
+			limit = self.index.max_distance(token)
+			expected = {word: bounded_distance(token, word, limit) for word in self.index.tokens}
+			expected = {word: distance for word, distance in expected.items() if distance is not None}
+			self.assertEqual(self.index.similar(token, time.monotonic() + 10), expected, token)
+
+	def test_added_words(self):
+		index = self.index.copy(dict(self.index.tokens))
+		index.tokens['zebra'] = [0]
+		index.add_words(['zebra'])
+		self.assertEqual(index.similar('zebar', time.monotonic() + 10)['zebra'], 2)
+		self.assertNotIn('zebra', self.index.similar('zebar', time.monotonic() + 10))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,61 @@
+"""Tests of saving and loading snapshots.
+
+Run from the repository root: python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshot
+from snapshot import Snapshot, NoteRow, AssetRow, save_snapshot, load_snapshot
+from search import TextIndex, FacetIndex
+
+
+class SaveLoadTest(unittest.TestCase):
+
+	def setUp(self):
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		patch = mock.patch.object(snapshot, 'SNAPSHOTS_DIR', Path(directory.name))
+		patch.start()
+		self.addCleanup(patch.stop)
+
+	def round_trip(self, saved):
+		save_snapshot('test', 'sheet', saved)
+		return load_snapshot('test', 'sheet')
+
+	def test_notes(self):
+		rows = [NoteRow('Sheet', 'Category', 'Über title', 'https://docs.google.com/document/d/abc/edit'),
+				NoteRow('Sheet', 'Category', 'Other', '', 'https://example.com')]
+		index = TextIndex(row.title_key for row in rows)
+		loaded = self.round_trip(Snapshot(rows, '3', row_counts={'Sheet': 3}, index=index))
+
+		self.assertEqual(loaded.rows, rows)
+		self.assertEqual([row.title_key for row in loaded.rows], ['uber title', 'other'])
+		self.assertEqual(loaded.version, '3')
+		self.assertEqual(loaded.row_counts, {'Sheet': 3})
+		self.assertEqual(loaded.index.candidates('ber'), [0])
+		self.assertEqual(list(loaded.index.tokens['other']), [1])
+
+	def test_assets(self):
+		rows = [AssetRow('Asset', '5.1', 'Rock', 'stone, nature', 'thumb', 'file')]
+		loaded = self.round_trip(Snapshot(rows, '1', sheet='assets', facets=FacetIndex(rows)))
+		self.assertEqual(loaded.rows, rows)
+		self.assertEqual(loaded.facets.select([('tag', 'stone')]), [0])
+
+	def test_empty(self):
+		self.assertEqual(self.round_trip(Snapshot([], '1')).rows, [])
+
+	def test_other_format(self):
+		save_snapshot('test', 'sheet', Snapshot([], '1'))
+		with mock.patch.object(snapshot, 'SNAPSHOT_FORMAT', snapshot.SNAPSHOT_FORMAT + 1):
+			self.assertIsNone(load_snapshot('test', 'sheet'))
+
+
+if __name__ == '__main__':
+	unittest.main()